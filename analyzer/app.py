@@ -1,6 +1,5 @@
 import threading
 import connexion
-import json
 import yaml
 import logging.config
 import os
@@ -10,6 +9,9 @@ from pykafka.common import OffsetType
 import time
 import atexit
 from flask_cors import CORS  # Import CORS
+import envelope
+from deadletter import DeadLetterQueue, supervise
+from consumer_metrics import ConsumerMetrics
 
 # Check for environment type and set configuration files accordingly
 if "TARGET_ENV" in os.environ and os.environ["TARGET_ENV"] == "test":
@@ -39,9 +41,22 @@ if "TARGET_ENV" not in os.environ or os.environ["TARGET_ENV"] != "test":
 KAFKA_HOST = f"{app_config['events']['hostname']}:{app_config['events']['port']}"
 KAFKA_TOPIC = app_config['events']['topic']
 
+# Consumer restart and dead-letter settings
+consumer_config = app_config['consumer']
+dead_letter_config = app_config['dead_letter']
+dead_letters = DeadLetterQueue(
+    dead_letter_config['filepath'],
+    KAFKA_TOPIC,
+    max_retries=dead_letter_config['max_retries'],
+    backoff_ms=dead_letter_config['backoff_ms']
+)
+
+consumer_metrics = ConsumerMetrics(consumer_config['lag_warning'], consumer_config['lag_critical'])
+
 # Initialize Kafka client and topic
 client = KafkaClient(hosts=KAFKA_HOST)
 topic = client.topics[KAFKA_TOPIC.encode('utf-8')]
+consumer_metrics.watch(topic)
 
 # Shared event counts and event storage
 event_counts = {
@@ -57,35 +72,51 @@ event_store = {
 
 # Kafka consumer function
 def consume_messages():
-    global event_counts, event_store
-
-    consumer = topic.get_simple_consumer(
+    # Balanced so that analyzer replicas split the topic's partitions between them
+    consumer = topic.get_balanced_consumer(
         consumer_group=b'analyzer_group',
+        managed=True,
         reset_offset_on_start=True,
         auto_offset_reset=OffsetType.EARLIEST
     )
 
     logger.info("Starting Kafka consumer...")
 
-    for msg in consumer:
-        if msg is not None:
-            msg_str = msg.value.decode('utf-8')
-            event = json.loads(msg_str)
-            logger.info(f"Consumed message: {event}")
+    # Leave the group on the way out so a restart gets the partitions back at once
+    try:
+        for msg in consumer:
+            if msg is not None:
+                started = time.monotonic()
+                dead_letters.handle(msg, record_event)
+                consumer_metrics.record([msg], time.monotonic() - started)
+                consumer_metrics.commit(consumer)
+    finally:
+        consumer.stop()
+
+
+def record_event(msg):
+    """ Decode one message and add its event to the store and counts """
+    global event_counts, event_store
 
-            # Store event data by type and increment counts
-            if event['type'] == 'create':
-                event_store["create"].append(event)
-                event_counts["create_count"] += 1
-            elif event['type'] == 'complete':
-                event_store["complete"].append(event)
-                event_counts["complete_count"] += 1
+    event = envelope.decode(msg.value)
+    logger.info(f"Consumed message: {event}")
 
-            consumer.commit_offsets()
+    # Store event data by type and increment counts
+    if event['type'] == 'create':
+        event_store["create"].append(event)
+        event_counts["create_count"] += 1
+    elif event['type'] == 'complete':
+        event_store["complete"].append(event)
+        event_counts["complete_count"] += 1
 
 
 def start_kafka_consumer():
-    kafka_thread = threading.Thread(target=consume_messages, daemon=True)
+    kafka_thread = threading.Thread(
+        target=supervise,
+        args=("Kafka consumer", consume_messages,
+              consumer_config['restart_backoff_ms'], consumer_config['max_restart_backoff_ms']),
+        daemon=True
+    )
     kafka_thread.start()
 
 
@@ -94,6 +125,14 @@ def get_stats():
     return jsonify(event_counts), 200
 
 
+def get_metrics():
+    """ Return the consumer lag, throughput and dead-letter counts as JSON """
+    return jsonify({
+        "consumer": consumer_metrics.snapshot(),
+        "dead_letters": dead_letters.snapshot()
+    }), 200
+
+
 def get_event1():
     try:
         index = int(request.args.get('index'))
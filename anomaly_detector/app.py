@@ -6,8 +6,11 @@ import yaml
 from datetime import datetime
 from pykafka import KafkaClient
 from threading import Thread
-from time import sleep
+from time import sleep, monotonic
 from connexion import FlaskApp
+import envelope
+from deadletter import DeadLetterQueue, supervise
+from consumer_metrics import ConsumerMetrics
 
 # Environment-based configuration
 if "TARGET_ENV" in os.environ and os.environ["TARGET_ENV"] == "test":
@@ -42,6 +45,17 @@ kafka_topic = kafka_config['topic']
 JSON_FILE_PATH = app_config['data_store']['filepath']
 THRESHOLDS = app_config['thresholds']
 
+# Consumer restart and dead-letter settings
+consumer_config = app_config['consumer']
+dead_letter_config = app_config['dead_letter']
+dead_letters = DeadLetterQueue(
+    dead_letter_config['filepath'],
+    kafka_topic,
+    max_retries=dead_letter_config['max_retries'],
+    backoff_ms=dead_letter_config['backoff_ms']
+)
+consumer_metrics = ConsumerMetrics(consumer_config['lag_warning'], consumer_config['lag_critical'])
+
 # Create Flask app
 app = FlaskApp(__name__, specification_dir='')
 app.add_api("openapi.yml", strict_validation=True, validate_responses=True)
@@ -117,15 +131,37 @@ def detect_anomaly(event):
 def process_kafka_events():
     client = KafkaClient(hosts=f"{kafka_hostname}:{kafka_port}")
     topic = client.topics[str.encode(kafka_topic)]
-    consumer = topic.get_simple_consumer()
-    for message in consumer:
-        if message is not None:
-            event = json.loads(message.value.decode('utf-8'))
-            logger.info(f"Event consumed: {event}")
-            detect_anomaly(event)
-
-# Start the Kafka consumer in a separate thread
-Thread(target=process_kafka_events, daemon=True).start()
+    consumer_metrics.watch(topic)
+    # Balanced so that detector replicas split the topic's partitions between them
+    consumer = topic.get_balanced_consumer(
+        consumer_group=b'anomaly_group',
+        managed=True
+    )
+    # Leave the group on the way out so a restart gets the partitions back at once
+    try:
+        for message in consumer:
+            if message is not None:
+                started = monotonic()
+                dead_letters.handle(message, process_message)
+                consumer_metrics.record([message], monotonic() - started)
+                # Commit so a restarted consumer resumes here instead of re-detecting
+                consumer_metrics.commit(consumer)
+    finally:
+        consumer.stop()
+
+def process_message(message):
+    """Decode one message and check its event for anomalies."""
+    event = envelope.decode(message.value)
+    logger.info(f"Event consumed: {event}")
+    detect_anomaly(event)
+
+# Start the Kafka consumer in a separate thread, restarted whenever it stops
+Thread(
+    target=supervise,
+    args=("Kafka consumer", process_kafka_events,
+          consumer_config['restart_backoff_ms'], consumer_config['max_restart_backoff_ms']),
+    daemon=True
+).start()
 
 # New function to get anomalies
 def get_anomalies(anomaly_type=None):
@@ -143,6 +179,13 @@ def get_anomalies(anomaly_type=None):
     
     return anomalies
 
+# Consumer lag, throughput and dead-letter counts
+def get_metrics():
+    return {
+        "consumer": consumer_metrics.snapshot(),
+        "dead_letters": dead_letters.snapshot()
+    }
+
 # Register the function with Connexion
 app.add_url_rule('/anomalies', 'get_anomalies', get_anomalies, methods=['GET'])
 
@@ -1,17 +1,26 @@
 import os
-import json
 import logging
 import logging.config
+import threading
 from datetime import datetime
+from time import monotonic
 import connexion
 import pytz
-import requests
 import yaml
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import jsonify, request
+from flask import jsonify, request, Response
 from flask_cors import CORS
-from sqlalchemy import create_engine
+from pykafka import KafkaClient
+from pykafka.common import OffsetType
 from sqlalchemy.orm import sessionmaker
+from db import create_db_engine, pool_stats
+from storage_client import StorageClient
+from stats_store import StatsStore
+from rollups import Rollups, GRANULARITIES
+import envelope
+from event_stats import OpenTasks, SeenEvents, count_event
+from deadletter import DeadLetterQueue, supervise
+from consumer_metrics import ConsumerMetrics
 
 # Check for the environment and set config file paths accordingly
 if "TARGET_ENV" in os.environ and os.environ["TARGET_ENV"] == "test":
@@ -43,17 +52,57 @@ MAX_EVENTS = 5
 
 # Database configuration
 db_config = app_config['datastore']
-DATABASE_URL = (
-    f"mysql+pymysql://{db_config['user']}:{db_config['password']}@"
-    f"{db_config['hostname']}:{db_config['port']}/{db_config['db']}"
-)
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine(db_config)
 Session = sessionmaker(bind=engine)
 
 # Stats file and scheduler interval
 STATS_FILE = app_config['datastore']['filename']
 PERIODIC_INTERVAL = app_config['scheduler']['period_sec']
 
+# 'poll' reads storage's aggregates every PERIODIC_INTERVAL, 'stream' consumes the events topic
+STATS_MODE = app_config.get('stats', {}).get('mode', 'poll')
+
+# Minute bucket format of the storage aggregates breakdown
+MINUTE_FORMAT = "%Y-%m-%dT%H:%M"
+
+# Current stats and rollups, resumed from the last snapshot written
+stats_store = StatsStore(STATS_FILE)
+rollups = Rollups(app_config.get('rollups'))
+rollups.load(stats_store.state.get('rollups'))
+
+# Kafka consumer configuration, read only in the stream mode so the poll mode
+# runs without the 'events', 'consumer' and 'dead_letter' sections
+consumer_config = open_tasks = seen_events = dead_letters = consumer_metrics = None
+# Last offset counted per partition in the stream mode, ahead of the snapshot's between snapshots
+stream_offsets = None
+if STATS_MODE == 'stream':
+    KAFKA_HOST = f"{app_config['events']['hostname']}:{app_config['events']['port']}"
+    KAFKA_TOPIC = app_config['events']['topic']
+    consumer_config = app_config['consumer']
+    CONSUMER_BATCH_SIZE = consumer_config['batch_size']
+    CONSUMER_FLUSH_MS = consumer_config['flush_ms']
+    SNAPSHOT_INTERVAL = consumer_config.get('snapshot_interval_ms', 5000) / 1000
+    open_tasks = OpenTasks(consumer_config['open_tasks'], stats_store.state.get('open_tasks'))
+    seen_events = SeenEvents(consumer_config.get('seen_events', 100000), stats_store.state.get('seen'))
+
+    dead_letter_config = app_config['dead_letter']
+    dead_letters = DeadLetterQueue(
+        dead_letter_config['filepath'],
+        KAFKA_TOPIC,
+        max_retries=dead_letter_config['max_retries'],
+        backoff_ms=dead_letter_config['backoff_ms']
+    )
+    consumer_metrics = ConsumerMetrics(consumer_config['lag_warning'], consumer_config['lag_critical'])
+
+# Storage service client
+eventstore_config = app_config['eventstore']
+storage_client = StorageClient(
+    eventstore_config['url'],
+    connect_timeout_sec=eventstore_config.get('connect_timeout_sec', 3),
+    read_timeout_sec=eventstore_config.get('read_timeout_sec', 10),
+    pool_size=eventstore_config.get('pool_size', 10)
+)
+
 def tasks():
     """Fetch and return tasks from an external service based on provided timestamps."""
     try:
@@ -66,10 +115,7 @@ def tasks():
         if end_timestamp:
             params['end_timestamp'] = end_timestamp
 
-        response = requests.get(
-            "http://ec2-44-229-192-171.us-west-2.compute.amazonaws.com/storage/tasks",
-            params=params,
-        )
+        response = storage_client.get("/storage/tasks", params=params)
 
         if response.status_code == 200:
             tasks_data = response.json()
@@ -94,10 +140,7 @@ def completed_tasks():
         if end_timestamp:
             params['end_timestamp'] = end_timestamp
 
-        response = requests.get(
-            "http://ec2-44-229-192-171.us-west-2.compute.amazonaws.com/storage/completed_tasks",
-            params=params,
-        )
+        response = storage_client.get("/storage/completed_tasks", params=params)
 
         if response.status_code == 200:
             completed_tasks_data = response.json()
@@ -110,100 +153,262 @@ def completed_tasks():
         logger.error("Exception in completed_tasks: %s", str(e))
         return jsonify({"message": "Completed tasks not found"}), 400
 
-def populate_stats():
-    """Periodically update stats with incremental processing."""
-    logger.info("Start Periodic Processing")
-    logger.info("ASSIGNMENT 3!")
-
-    utc_tz = pytz.utc
-    stats = {
+def initial_stats():
+    """Return the stats before any event has been counted."""
+    return {
         "num_tasks": 0,
         "completed_tasks": 0,
         "max_task_difficulty": 0,
         "avg_task_difficulty": 0,
-        "last_updated": datetime.now(utc_tz).strftime('%Y-%m-%dT%H:%M:%SZ')
+        "last_updated": datetime.now(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
     }
 
-    if os.path.exists(STATS_FILE):
-        with open(STATS_FILE, 'r') as file:
-            stats = json.load(file)
+def populate_stats():
+    """Periodically update stats with the rows stored since the last checkpointed id cursors."""
+    logger.info("Start Periodic Processing")
+    logger.info("ASSIGNMENT 3!")
 
-    start_timestamp = stats["last_updated"]
-    end_timestamp = datetime.now(utc_tz).strftime('%Y-%m-%dT%H:%M:%SZ')
+    stats = stats_store.current()
+    if stats is None or "last_task_id" not in stats:
+        if stats is not None:
+            # Stats counted from timestamp windows or the topic cannot be continued exactly, so count again
+            logger.warning("Statistics have no id cursors, recounting all stored rows")
+        stats = {**initial_stats(), "last_task_id": 0, "last_completed_id": 0}
+        rollups.load(None)
 
-    logger.debug("Fetching tasks from %s to %s", start_timestamp, end_timestamp)
+    logger.debug("Fetching tasks after id %d and completed tasks after id %d",
+                 stats["last_task_id"], stats["last_completed_id"])
 
     try:
-        new_task_events = requests.get(
-            f"http://ec2-44-229-192-171.us-west-2.compute.amazonaws.com/storage/tasks"
-            f"?start_timestamp={start_timestamp}&end_timestamp={end_timestamp}"
-        )
-        new_completed_events = requests.get(
-            f"http://ec2-44-229-192-171.us-west-2.compute.amazonaws.com/storage/completed_tasks"
-            f"?start_timestamp={start_timestamp}&end_timestamp={end_timestamp}"
+        # Storage aggregates the new rows in SQL, so only the summary crosses the network
+        aggregates_response = storage_client.get(
+            "/storage/aggregates",
+            params={"after_task_id": stats["last_task_id"], "after_completed_id": stats["last_completed_id"],
+                    "by_minute": "true"},
         )
 
-        logger.debug("Task Events Status: %d", new_task_events.status_code)
-        logger.debug("Completed Events Status: %d", new_completed_events.status_code)
+        logger.debug("Aggregates Status: %d", aggregates_response.status_code)
 
-        if new_task_events.status_code == 200 and new_completed_events.status_code == 200:
-            task_data = new_task_events.json()
-            completed_data = new_completed_events.json()
+        if aggregates_response.status_code == 200:
+            aggregates = aggregates_response.json()
+            new_tasks = aggregates["tasks"]
+            new_completed = aggregates["completed_tasks"]
 
-            logger.debug("Task Data: %s", task_data)
-            logger.debug("Completed Data: %s", completed_data)
+            logger.debug("Aggregates: %s", aggregates)
 
-            stats["num_tasks"] += len(task_data)
-            stats["completed_tasks"] += len(completed_data)
+            stats["num_tasks"] += new_tasks["count"]
+            stats["completed_tasks"] += new_completed["count"]
 
-            if task_data:
-                max_difficulty = max(task["task_difficulty"] for task in task_data)
-                stats["max_task_difficulty"] = max(stats["max_task_difficulty"], max_difficulty)
+            if new_tasks["count"]:
+                if new_tasks["difficulty_max"] is not None:
+                    stats["max_task_difficulty"] = max(stats["max_task_difficulty"], new_tasks["difficulty_max"])
 
                 total_difficulty = (
-                    (stats["avg_task_difficulty"] * (stats["num_tasks"] - len(task_data)))
-                    + sum(task["task_difficulty"] for task in task_data)
+                    (stats["avg_task_difficulty"] * (stats["num_tasks"] - new_tasks["count"]))
+                    + new_tasks["difficulty_sum"]
                 )
                 stats["avg_task_difficulty"] = total_difficulty / (stats["num_tasks"] or 1)
 
-            stats["last_updated"] = end_timestamp
-
-            stats_dir = os.path.dirname(STATS_FILE)
-            if not os.path.exists(stats_dir):
-                os.makedirs(stats_dir)
-
-            with open(STATS_FILE, 'w') as file:
-                json.dump(stats, file)
+            stats["last_task_id"] = new_tasks["last_id"]
+            stats["last_completed_id"] = new_completed["last_id"]
+            stats["last_updated"] = datetime.now(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+            for minute, bucket in new_tasks["by_minute"].items():
+                rollups.add(datetime.strptime(minute, MINUTE_FORMAT), creates=bucket["count"],
+                            difficulty=bucket["difficulty_histogram"])
+            for minute, bucket in new_completed["by_minute"].items():
+                rollups.add(datetime.strptime(minute, MINUTE_FORMAT), completes=bucket["count"],
+                            completion_seconds=bucket.get("completion_seconds_histogram"))
+
+            try:
+                stats_store.update(stats, rollups=rollups.to_dict())
+            except OSError:
+                # The cursors stay where they were, so take the rollups back to match
+                rollups.load(stats_store.state.get('rollups'))
+                raise
             logger.info("Statistics updated successfully")
             logger.debug("Updated statistics: %s", stats)
         else:
             logger.error("Failed to fetch data")
-            if new_task_events.status_code != 200:
-                logger.error("Task Events Error: %s", new_task_events.text)
-            if new_completed_events.status_code != 200:
-                logger.error("Completed Events Error: %s", new_completed_events.text)
+            logger.error("Aggregates Error: %s", aggregates_response.text)
 
     except Exception as e:
         logger.error("Exception occurred: %s", str(e))
 
     logger.info("End Periodic Processing")
 
+def consume_events():
+    """
+    Count the events of the topic into the stats in micro-batches of up to
+    CONSUMER_BATCH_SIZE messages or CONSUMER_FLUSH_MS, for the stream mode.
+
+    The counts are published after every batch but snapshotted only every
+    SNAPSHOT_INTERVAL, and the offsets are committed after each snapshot, so
+    a restart resumes from the last snapshot and counts the rest again.
+    """
+    load_stream_state()
+
+    logger.info("Initializing Kafka consumer...")
+    client = KafkaClient(hosts=KAFKA_HOST)
+    topic = client.topics[KAFKA_TOPIC.encode('utf-8')]
+    consumer_metrics.watch(topic)
+    # The stats cover the whole topic, so one consumer reads every partition
+    consumer = topic.get_simple_consumer(
+        consumer_group=b'processing_stats',
+        auto_commit_enable=False,
+        reset_offset_on_start=False,
+        auto_offset_reset=OffsetType.EARLIEST,
+        consumer_timeout_ms=CONSUMER_FLUSH_MS
+    )
+
+    try:
+        # The group's committed offsets may be past events the stats have not
+        # counted, when they were counted in the poll mode or are new, so those
+        # partitions are read from the start
+        uncounted = [partition for partition_id, partition in consumer.partitions.items()
+                     if str(partition_id) not in stream_offsets]
+        if uncounted:
+            logger.info("Counting %d partition(s) from the start of the topic", len(uncounted))
+            consumer.reset_offsets([(partition, OffsetType.EARLIEST) for partition in uncounted])
+
+        logger.info("Starting Kafka consumer...")
+        flush_seconds = CONSUMER_FLUSH_MS / 1000
+        next_snapshot = monotonic() + SNAPSHOT_INTERVAL
+        unsaved = False
+        while True:
+            msgs = []
+            deadline = monotonic() + flush_seconds
+            while len(msgs) < CONSUMER_BATCH_SIZE and monotonic() < deadline:
+                # Returns None once the consumer timeout passes without a message
+                msg = consumer.consume(block=True)
+                if msg is not None:
+                    msgs.append(msg)
+
+            if msgs:
+                started = monotonic()
+                count_batch(msgs)
+                consumer_metrics.record(msgs, monotonic() - started)
+                unsaved = True
+
+            if unsaved and monotonic() >= next_snapshot:
+                save_stream_state()
+                # After the snapshot holding these offsets is written
+                consumer_metrics.commit(consumer)
+                unsaved = False
+                next_snapshot = monotonic() + SNAPSHOT_INTERVAL
+    finally:
+        consumer.stop()
+
+def load_stream_state():
+    """
+    Resume the stats, rollups, open tasks, seen events and counted offsets of
+    the stream mode from the last snapshot, dropping whatever was counted
+    after it, or start them over if the snapshot was not counted from the topic.
+    """
+    global stream_offsets
+    stats_store.load()
+    state = stats_store.state
+    if stats_store.snapshot is None or state.get('offsets') is None:
+        if stats_store.snapshot is not None:
+            logger.warning("Statistics were not counted from the topic, counting it from the start")
+        stats_store.publish(initial_stats())
+        state = {'offsets': {}}
+    rollups.load(state.get('rollups'))
+    open_tasks.load(state.get('open_tasks'))
+    seen_events.load(state.get('seen'))
+    stream_offsets = dict(state['offsets'])
+
+def save_stream_state():
+    """Write the published stats with the state counted into them to the snapshot."""
+    stats_store.update(stats_store.current(), rollups=rollups.to_dict(), open_tasks=open_tasks.to_dict(),
+                       seen=seen_events.to_dict(), offsets=dict(stream_offsets))
+
+def count_batch(msgs):
+    """
+    Count a batch of messages into the stats, rollups, open tasks and seen
+    events in memory, and publish the new stats.
+
+    Messages at or below the counted offsets were counted before a restart
+    whose offset commit did not happen, and are skipped, as are events of a
+    type and uuid already counted from another message. If counting raises,
+    the batch may be half counted, so the caller restarts from the snapshot.
+    """
+    stats = stats_store.current()
+    duplicates = 0
+
+    def count_message(msg):
+        nonlocal duplicates
+        if not count_event(stats, rollups, open_tasks, seen_events, envelope.decode(msg.value)):
+            duplicates += 1
+
+    for msg in msgs:
+        partition = str(msg.partition_id)
+        if msg.offset <= stream_offsets.get(partition, -1):
+            continue
+        dead_letters.handle(msg, count_message)
+        stream_offsets[partition] = msg.offset
+
+    stats["last_updated"] = datetime.now(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    stats_store.publish(stats)
+    logger.info("Counted batch of %d events, %d duplicates skipped", len(msgs), duplicates)
+
+def start_kafka_consumer():
+    """Start the supervised Kafka consumer thread of the stream mode."""
+    kafka_thread = threading.Thread(
+        target=supervise,
+        args=("Kafka consumer", consume_events,
+              consumer_config['restart_backoff_ms'], consumer_config['max_restart_backoff_ms']),
+        daemon=True
+    )
+    kafka_thread.start()
+
 def get_stats():
-    """Retrieve statistics from the stats JSON file."""
+    """Return the current statistics from memory, or 304 if the client's ETag matches them."""
     try:
-        if not os.path.exists(STATS_FILE):
-            logger.error("Stats file not found")
+        snapshot = stats_store.snapshot
+        if snapshot is None:
+            logger.error("No statistics computed yet")
             return jsonify({"message": "Stats file not found"}), 404
 
-        with open(STATS_FILE, 'r') as file:
-            stats = json.load(file)
+        if snapshot.etag in request.if_none_match:
+            return Response(status=304, headers={"ETag": f'"{snapshot.etag}"'})
 
         logger.info("Statistics retrieved successfully")
-        return jsonify(stats), 200
+        return Response(snapshot.body, 200, mimetype='application/json', headers={"ETag": f'"{snapshot.etag}"'})
     except Exception as e:
         logger.error("Exception in get_stats: %s", str(e))
         return jsonify({"message": "Failed to retrieve stats"}), 500
 
+def parse_time(timestamp):
+    """Parse an ISO 8601 query time into the naive local time the buckets use."""
+    time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if time.tzinfo is not None:
+        time = time.astimezone().replace(tzinfo=None)
+    return time
+
+def get_stats_series():
+    """Return the rollup buckets of a granularity between two times, with percentiles."""
+    granularity = request.args.get('granularity', 'minute')
+    try:
+        end = parse_time(request.args['to']) if 'to' in request.args else datetime.now()
+        if 'from' in request.args:
+            start = parse_time(request.args['from'])
+        else:
+            length, _ = GRANULARITIES[granularity]
+            start = end - length * rollups.rings[granularity].size
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify(rollups.series(granularity, start, end)), 200
+
+def get_metrics():
+    """Return the stats mode, the database connection pool figures and, in stream mode, the consumer figures."""
+    metrics = {"stats_mode": STATS_MODE, "db_pool": pool_stats.snapshot(engine.pool)}
+    if STATS_MODE == 'stream':
+        metrics["consumer"] = consumer_metrics.snapshot()
+        metrics["dead_letters"] = dead_letters.snapshot()
+    return jsonify(metrics), 200
+
 def init_scheduler():
     """Initialize and start the scheduler for periodic processing."""
     sched = BackgroundScheduler(daemon=True)
@@ -223,6 +428,9 @@ app.app.config['CORS_HEADERS'] = 'Content-Type'
 
 
 if __name__ == "__main__":
-    init_scheduler()
+    if STATS_MODE == 'stream':
+        start_kafka_consumer()
+    else:
+        init_scheduler()
     app.run(host="0.0.0.0", port=8100)
 
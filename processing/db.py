@@ -0,0 +1,155 @@
+"""
+This module builds the SQLAlchemy engines of a service and instruments their connection pools.
+
+The pool is configured from the 'pool' subsection of the 'datastore' section
+of app_conf.yml. Checkout waits, timeouts and invalidated connections are
+recorded so the pool figures tell pool starvation (long waits, timeouts, full
+overflow) apart from a slow database (short waits, connections busy).
+
+A 'url' key in the section replaces the MySQL URL built from its other keys,
+e.g. to run against a local SQLite file.
+"""
+
+import logging
+import threading
+from collections import deque
+from time import monotonic
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Number of recent checkout waits used for the wait figures
+WAIT_WINDOW = 1000
+
+POOL_DEFAULTS = {
+    'size': 10,
+    'max_overflow': 20,
+    'timeout_sec': 30,
+    'recycle_sec': 1800,
+    'pre_ping': True
+}
+
+
+class PoolStats:
+    """
+    Collects checkout counts and wait times of the instrumented pool.
+    """
+
+    def __init__(self):
+        """
+        Initializes empty statistics.
+        """
+        self.lock = threading.Lock()
+        self.waits = deque(maxlen=WAIT_WINDOW)
+        self.counts = {"checkouts": 0, "timeouts": 0, "connects": 0, "invalidated": 0}
+
+    def record_wait(self, seconds, timed_out=False):
+        """
+        Records one checkout attempt and how long it waited for a connection.
+        """
+        with self.lock:
+            if timed_out:
+                self.counts["timeouts"] += 1
+            else:
+                self.counts["checkouts"] += 1
+                self.waits.append(seconds * 1000)
+
+    def increment(self, name):
+        """
+        Increments one of the event counts.
+        """
+        with self.lock:
+            self.counts[name] += 1
+
+    def snapshot(self, pool):
+        """
+        Returns the pool occupancy and the recorded counts and wait figures.
+        """
+        with self.lock:
+            waits = sorted(self.waits)
+            stats = dict(self.counts)
+        stats["size"] = pool.size()
+        stats["checked_in"] = pool.checkedin()
+        stats["in_use"] = pool.checkedout()
+        # QueuePool counts overflow from -size while the pool is still filling
+        stats["overflow"] = max(0, pool.overflow())
+        stats["max_overflow"] = pool._max_overflow
+        stats["wait_ms"] = {
+            "avg": sum(waits) / len(waits) if waits else 0,
+            "p99": percentile(waits, 99),
+            "max": waits[-1] if waits else 0
+        }
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that times how long each checkout waits for a connection.
+    """
+    stats = pool_stats
+
+    def _do_get(self):
+        """
+        Gets a connection from the pool, recording the wait.
+        """
+        started = monotonic()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_wait(monotonic() - started, timed_out=True)
+            raise
+        self.stats.record_wait(monotonic() - started)
+        return connection
+
+
+# The pool logs under its class name; keep it at SQLAlchemy's default level
+logging.getLogger(f"{__name__}.{InstrumentedQueuePool.__name__}").setLevel(logging.WARN)
+
+
+def database_url(db_config):
+    """
+    Returns the URL of the datastore section, MySQL unless it sets one.
+    """
+    if 'url' in db_config:
+        return db_config['url']
+    return (
+        f"mysql+pymysql://{db_config['user']}:{db_config['password']}@"
+        f"{db_config['hostname']}:{db_config['port']}/{db_config['db']}"
+    )
+
+
+def create_db_engine(db_config, stats=pool_stats):
+    """
+    Creates the engine of the datastore section with the configured pool,
+    instrumented into the given statistics.
+    """
+    pool_config = {**POOL_DEFAULTS, **db_config.get('pool', {})}
+    url = database_url(db_config)
+    # SQLite connections are shared between the pool's threads
+    connect_args = {'check_same_thread': False} if url.startswith('sqlite') else {}
+    engine = create_engine(
+        url,
+        connect_args=connect_args,
+        poolclass=type(InstrumentedQueuePool.__name__, (InstrumentedQueuePool,), {'stats': stats}),
+        pool_size=pool_config['size'],
+        max_overflow=pool_config['max_overflow'],
+        pool_timeout=pool_config['timeout_sec'],
+        pool_recycle=pool_config['recycle_sec'],
+        pool_pre_ping=pool_config['pre_ping']
+    )
+    event.listen(engine, 'connect', lambda *args: stats.increment("connects"))
+    event.listen(engine, 'invalidate', lambda *args: stats.increment("invalidated"))
+    return engine
+
+
+def percentile(sorted_values, pct):
+    """
+    Returns the nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0
+    rank = max(0, int(round(pct / 100 * len(sorted_values))) - 1)
+    return sorted_values[rank]
@@ -0,0 +1,144 @@
+"""
+This module counts the events of the Kafka topic into the processing stats, for the stream stats mode.
+
+Each 'create' and 'complete' event updates the stats and the rollups at the
+time the receiver stamped on it. The creation time of recently created
+tasks is kept, bounded by count, so that a completion can be timed against
+it; completions of tasks created before that are counted but not timed.
+
+The topic delivers at least once, so the uuids of the most recent create and
+complete events counted are kept too, also bounded by count, and an event of
+a type and uuid already counted is skipped.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from rollups import significant
+
+# Format of the 'datetime' the receiver stamps on each event
+EVENT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class OpenTasks:
+    """
+    Creation times of the most recently created tasks not completed yet, by uuid.
+    """
+
+    def __init__(self, max_entries, state=None):
+        """
+        Initializes the tasks from their to_dict state, if any.
+        """
+        self.max_entries = max_entries
+        self.created = OrderedDict()
+        self.load(state)
+
+    def add(self, uuid, created_at):
+        """
+        Records the creation time of a task, forgetting the oldest task past the bound.
+        """
+        self.created[uuid] = created_at
+        self.created.move_to_end(uuid)
+        while len(self.created) > self.max_entries:
+            self.created.popitem(last=False)
+
+    def pop(self, uuid):
+        """
+        Removes a task and returns its creation time, or None if it is not known.
+        """
+        return self.created.pop(uuid, None)
+
+    def to_dict(self):
+        """
+        Returns the tasks, oldest first, for persistence.
+        """
+        return {uuid: created_at.strftime(EVENT_TIME_FORMAT) for uuid, created_at in self.created.items()}
+
+    def load(self, state):
+        """
+        Replaces the tasks with the ones saved by to_dict.
+        """
+        self.created = OrderedDict(
+            (uuid, datetime.strptime(created_at, EVENT_TIME_FORMAT)) for uuid, created_at in (state or {}).items()
+        )
+
+
+class SeenEvents:
+    """
+    The type and uuid of the most recently counted events.
+    """
+
+    def __init__(self, max_entries, state=None):
+        """
+        Initializes the events from their to_dict state, if any.
+        """
+        self.max_entries = max_entries
+        self.keys = OrderedDict()
+        self.load(state)
+
+    def __contains__(self, key):
+        """
+        Returns whether an event key, 'type:uuid', was counted.
+        """
+        return key in self.keys
+
+    def add(self, key):
+        """
+        Records a counted event, forgetting the oldest one past the bound.
+        """
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+        while len(self.keys) > self.max_entries:
+            self.keys.popitem(last=False)
+
+    def to_dict(self):
+        """
+        Returns the events, oldest first, for persistence.
+        """
+        return list(self.keys)
+
+    def load(self, state):
+        """
+        Replaces the events with the ones saved by to_dict.
+        """
+        self.keys = OrderedDict.fromkeys(state or [])
+
+
+def count_event(stats, rollups, open_tasks, seen, event):
+    """
+    Adds one decoded event to the stats, the rollups and the open tasks,
+    unless an event of its type and uuid was counted already. Returns whether
+    it was counted.
+
+    Raises ValueError or KeyError, before changing anything, for an event
+    that is malformed or of an unknown type.
+    """
+    event_type = event['type']
+    time = datetime.strptime(event['datetime'], EVENT_TIME_FORMAT)
+    payload = event['payload']
+    uuid = payload['uuid']
+    if event_type not in ('create', 'complete'):
+        raise ValueError(f"Unknown event type: {event_type}")
+
+    key = f"{event_type}:{uuid}"
+    if key in seen:
+        return False
+
+    if event_type == 'create':
+        difficulty = payload.get('task_difficulty')
+        if difficulty is not None:
+            difficulty = int(difficulty)
+        stats["num_tasks"] += 1
+        if difficulty is not None:
+            stats["max_task_difficulty"] = max(stats["max_task_difficulty"], difficulty)
+        stats["avg_task_difficulty"] = (
+            (stats["avg_task_difficulty"] * (stats["num_tasks"] - 1) + (difficulty or 0)) / stats["num_tasks"]
+        )
+        rollups.add(time, creates=1, difficulty={difficulty: 1} if difficulty is not None else None)
+        open_tasks.add(uuid, time)
+    elif event_type == 'complete':
+        stats["completed_tasks"] += 1
+        created_at = open_tasks.pop(uuid)
+        seconds = {significant((time - created_at).total_seconds()): 1} if created_at is not None else None
+        rollups.add(time, completes=1, completion_seconds=seconds)
+    seen.add(key)
+    return True
@@ -0,0 +1,236 @@
+"""
+This module keeps per-minute, per-hour and per-day rollups of the task events for the processing service.
+
+Each granularity is a ring of a fixed number of buckets, so memory does not
+grow with time: a bucket's slot is reused once the ring has moved a full
+turn past it. A bucket counts the tasks created and completed in its time
+range and keeps two histograms, one of task difficulty and one of the
+seconds from creation to completion. Histogram values are exact difficulties
+and durations rounded to two significant digits, HDR style, so histograms
+merge by adding counts and give percentiles within about 5%.
+
+Bucket times are the storage service's date_created clock.
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+# Bucket length and default number of buckets kept per granularity
+GRANULARITIES = {
+    "minute": (timedelta(minutes=1), 1440),
+    "hour": (timedelta(hours=1), 720),
+    "day": (timedelta(days=1), 365)
+}
+PERCENTILES = (50, 95, 99)
+EPOCH = datetime(1970, 1, 1)
+
+
+def significant(seconds):
+    """
+    Rounds a duration to two significant digits, the histogram value it is counted as.
+    """
+    return '%g' % float(f"{max(seconds, 0):.2g}")
+
+
+class Histogram:
+    """
+    Counts per value, mergeable by adding counts.
+    """
+
+    def __init__(self, counts=None):
+        """
+        Initializes the histogram from a {value: count} dict with numeric or string keys.
+        """
+        self.counts = {}
+        self.merge(counts or {})
+
+    def merge(self, counts):
+        """
+        Adds the counts of a {value: count} dict.
+        """
+        for value, count in counts.items():
+            value = float(value)
+            self.counts[value] = self.counts.get(value, 0) + count
+
+    def percentiles(self):
+        """
+        Returns the count, p50, p95, p99 and max of the values, with None figures when empty.
+        """
+        total = sum(self.counts.values())
+        figures = {"count": total}
+        values = sorted(self.counts.items())
+        for percentile in PERCENTILES:
+            figures[f"p{percentile}"] = None
+            rank = percentile / 100 * total
+            seen = 0
+            for value, count in values:
+                seen += count
+                if seen >= rank:
+                    figures[f"p{percentile}"] = value
+                    break
+        figures["max"] = values[-1][0] if values else None
+        return figures
+
+    def to_dict(self):
+        """
+        Returns the counts with the values as JSON object keys.
+        """
+        return {'%g' % value: count for value, count in self.counts.items()}
+
+
+class Bucket:
+    """
+    The created and completed counts and histograms of one time range.
+    """
+
+    def __init__(self, start, state=None):
+        """
+        Initializes an empty bucket, or one from its to_dict state.
+        """
+        state = state or {}
+        self.start = start
+        self.creates = state.get("creates", 0)
+        self.completes = state.get("completes", 0)
+        self.difficulty = Histogram(state.get("difficulty"))
+        self.completion_seconds = Histogram(state.get("completion_seconds"))
+
+    def add(self, other):
+        """
+        Adds the counts and histograms of another bucket.
+        """
+        self.creates += other.creates
+        self.completes += other.completes
+        self.difficulty.merge(other.difficulty.counts)
+        self.completion_seconds.merge(other.completion_seconds.counts)
+
+    def summary(self):
+        """
+        Returns the counts and the percentiles of the histograms.
+        """
+        return {
+            "creates": self.creates,
+            "completes": self.completes,
+            "difficulty": self.difficulty.percentiles(),
+            "completion_seconds": self.completion_seconds.percentiles()
+        }
+
+    def to_dict(self):
+        """
+        Returns the state of the bucket for persistence.
+        """
+        return {
+            "start": self.start.isoformat(),
+            "creates": self.creates,
+            "completes": self.completes,
+            "difficulty": self.difficulty.to_dict(),
+            "completion_seconds": self.completion_seconds.to_dict()
+        }
+
+
+class Ring:
+    """
+    A fixed number of consecutive buckets of one length, the newest replacing the oldest.
+    """
+
+    def __init__(self, length, size):
+        """
+        Initializes an empty ring.
+        """
+        self.length = length
+        self.size = size
+        self.slots = [None] * size
+
+    def floor(self, time):
+        """
+        Returns the start of the bucket holding a time.
+        """
+        return time - (time - EPOCH) % self.length
+
+    def bucket(self, start):
+        """
+        Returns the bucket starting at start, replacing the older bucket in its slot.
+        """
+        slot = int((start - EPOCH) / self.length) % self.size
+        bucket = self.slots[slot]
+        if bucket is None or bucket.start != start:
+            if bucket is not None and bucket.start > start:
+                # Older than the whole ring
+                return None
+            bucket = self.slots[slot] = Bucket(start)
+        return bucket
+
+    def range(self, start, end):
+        """
+        Returns the buckets starting in [start, end), oldest first.
+        """
+        return sorted((bucket for bucket in self.slots
+                       if bucket is not None and start <= bucket.start < end), key=lambda bucket: bucket.start)
+
+
+class Rollups:
+    """
+    The minute, hour and day rings, updated together.
+    """
+
+    def __init__(self, sizes=None):
+        """
+        Initializes empty rings, with the number of buckets per granularity from sizes.
+        """
+        sizes = sizes or {}
+        self.lock = threading.Lock()
+        self.rings = {
+            name: Ring(length, sizes.get(name, size))
+            for name, (length, size) in GRANULARITIES.items()
+        }
+
+    def add(self, time, creates=0, completes=0, difficulty=None, completion_seconds=None):
+        """
+        Counts events of a time in the bucket holding it at every granularity.
+        """
+        delta = Bucket(None, {"creates": creates, "completes": completes,
+                              "difficulty": difficulty, "completion_seconds": completion_seconds})
+        with self.lock:
+            for ring in self.rings.values():
+                bucket = ring.bucket(ring.floor(time))
+                if bucket is not None:
+                    bucket.add(delta)
+
+    def series(self, granularity, start, end):
+        """
+        Returns the summaries of the buckets of a granularity in [start, end) and of all of them merged.
+        """
+        ring = self.rings[granularity]
+        total = Bucket(None)
+        buckets = []
+        with self.lock:
+            for bucket in ring.range(ring.floor(start), end):
+                total.add(bucket)
+                buckets.append({"start": bucket.start.isoformat(), **bucket.summary()})
+        return {"granularity": granularity, "buckets": buckets, "total": total.summary()}
+
+    def to_dict(self):
+        """
+        Returns the buckets of every ring for persistence.
+        """
+        with self.lock:
+            return {
+                name: [bucket.to_dict() for bucket in ring.slots if bucket is not None]
+                for name, ring in self.rings.items()
+            }
+
+    def load(self, state):
+        """
+        Replaces the buckets with the ones saved by to_dict.
+        """
+        with self.lock:
+            for ring in self.rings.values():
+                ring.slots = [None] * ring.size
+            for name, buckets in (state or {}).items():
+                ring = self.rings.get(name)
+                if ring is None:
+                    continue
+                for saved in buckets:
+                    start = datetime.fromisoformat(saved["start"])
+                    bucket = ring.bucket(start)
+                    if bucket is not None:
+                        bucket.add(Bucket(start, saved))
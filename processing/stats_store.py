@@ -0,0 +1,111 @@
+"""
+This module keeps the current task statistics of the processing service in memory and persists them atomically.
+
+Each update builds a new immutable snapshot (the stats, their JSON body and
+an ETag of it) and publishes it with a single reference assignment, so
+readers never take a lock and never see a partial update. The stats are first
+written to a temporary file next to the stats file and renamed over it, so
+after a crash or restart the file holds either the previous or the new
+snapshot and the service resumes from the last good one.
+
+The file holds the stats under 'stats' next to any other state saved with
+them, such as the rollups, so they are always restored consistently with
+each other. Files holding the bare stats are still read.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger('basicLogger')
+
+
+class StatsSnapshot:
+    """
+    A published version of the stats, with the JSON body served for it and its ETag.
+    """
+
+    def __init__(self, stats):
+        """
+        Serializes the stats and computes the ETag of the body.
+        """
+        self.stats = stats
+        self.body = json.dumps(stats, sort_keys=True).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+
+class StatsStore:
+    """
+    The current stats snapshot and the file it is persisted to.
+    """
+
+    def __init__(self, filepath):
+        """
+        Initializes the store from the stats file, if there is one.
+        """
+        self.filepath = filepath
+        self.snapshot = None
+        self.state = {}
+        self.load()
+
+    def load(self):
+        """
+        Publishes the stats held in the stats file; a missing or unreadable file leaves no stats.
+        """
+        self.snapshot = None
+        self.state = {}
+        if not os.path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, 'r') as file:
+                document = json.load(file)
+            if isinstance(document.get("stats"), dict):
+                self.snapshot = StatsSnapshot(document.pop("stats"))
+                self.state = document
+            else:
+                self.snapshot = StatsSnapshot(document)
+            logger.info("Statistics loaded from %s", self.filepath)
+        except (OSError, ValueError) as e:
+            logger.error("Could not load statistics from %s: %s", self.filepath, str(e))
+
+    def current(self):
+        """
+        Returns a copy of the current stats to update, or None if there are none yet.
+        """
+        snapshot = self.snapshot
+        return json.loads(snapshot.body) if snapshot is not None else None
+
+    def publish(self, stats):
+        """
+        Publishes new stats without persisting them; the state saved with the last update is kept.
+        """
+        self.snapshot = StatsSnapshot(stats)
+
+    def update(self, stats, **state):
+        """
+        Persists new stats with the state saved alongside them, and then
+        publishes them. Raises OSError if they could not be written.
+        """
+        snapshot = StatsSnapshot(stats)
+        self.persist(json.dumps({"stats": stats, **state}).encode('utf-8'))
+        self.state = state
+        self.snapshot = snapshot
+
+    def persist(self, body):
+        """
+        Replaces the stats file with the body through a temporary file in the same directory.
+        """
+        directory = os.path.dirname(self.filepath) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.stats-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(body)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.filepath)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
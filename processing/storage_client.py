@@ -0,0 +1,42 @@
+"""
+This module is the HTTP client the processing service uses to call the storage service.
+
+All calls share one requests.Session, whose connection pool keeps the TCP
+connections to storage open between polls, and every call is bounded by a
+connect and a read timeout so a storage instance that stops answering cannot
+hold up the scheduled job or a request thread. The base URL and the timeouts
+come from the 'eventstore' section of app_conf.yml.
+"""
+
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('basicLogger')
+
+
+class StorageClient:
+    """
+    Pooled, timeout-bounded GET requests against the storage service.
+    """
+
+    def __init__(self, base_url, connect_timeout_sec=3, read_timeout_sec=10, pool_size=10):
+        """
+        Initializes the client for a base URL such as http://storage:8090.
+        """
+        if '://' not in base_url:
+            base_url = f"http://{base_url}"
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout_sec, read_timeout_sec)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, path, params=None):
+        """
+        Sends a GET request to a storage path, e.g. '/storage/tasks', and returns the response.
+
+        Raises requests.RequestException, including requests.Timeout, when no response arrives in time.
+        """
+        return self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
@@ -5,13 +5,23 @@ from datetime import datetime
 import logging
 import logging.config
 import uuid
-from time import sleep
+import threading
+from queue import Empty
+from time import sleep, monotonic
 import yaml
 import os
-from flask import jsonify
+from flask import jsonify, request
 from pykafka import KafkaClient
+from pykafka.common import CompressionType
+from pykafka.partitioners import hashing_partitioner
 import connexion
 from connexion import NoContent
+from connexion.json_schema import Draft4RequestValidator
+from jsonschema import draft4_format_checker
+from publisher import AsyncPublisher, QueueFullError
+from spool import Spool, SpoolFullError
+from idempotency import IdempotencyCache
+import envelope
 
 # LOGGING CONFIGURATION
 # Determine configuration file paths based on environment
@@ -55,18 +65,76 @@ kafka_config = app_config['events']
 kafka_hostname = kafka_config['hostname']
 kafka_port = kafka_config['port']
 kafka_topic = kafka_config['topic']
+EVENT_ENCODING = kafka_config['encoding']
+
+# Batch ingest configuration
+batch_config = app_config['batch']
+BATCH_MAX_ITEMS = batch_config['max_items']
+BATCH_LINGER_MS = batch_config['linger_ms']
+BATCH_DELIVERY_TIMEOUT = batch_config['delivery_timeout_sec']
+
+# Producer configuration; 'async' mode acknowledges requests before the broker does
+producer_config = app_config['producer']
+PRODUCER_MODE = producer_config['mode']
+PRODUCER_QUEUE_SIZE = producer_config['queue_size']
+PRODUCER_LINGER_MS = producer_config['linger_ms']
+PRODUCER_MAX_BATCH_SIZE = producer_config['max_batch_size']
+PRODUCER_COMPRESSION = getattr(CompressionType, producer_config['compression'].upper())
+QUEUE_FULL_STATUS = producer_config['queue_full_status']
+QUEUE_FULL_RETRY_AFTER = producer_config['retry_after_sec']
+
+# Local spool configuration, used while Kafka is unavailable or saturated,
+# and in sync mode as the write path of single events
+spool_config = app_config['spool']
+SPOOL_ENABLED = spool_config['enabled']
+SPOOL_DRAIN_BATCH_SIZE = spool_config['drain_batch_size']
+SPOOL_DRAIN_IDLE_SEC = spool_config['drain_idle_ms'] / 1000
+SPOOL_RETRY_INTERVAL = spool_config['retry_interval_sec']
+
+# Idempotency configuration, so client retries do not produce duplicate events
+idempotency_config = app_config['idempotency']
+idempotency = None
+if idempotency_config['enabled']:
+    idempotency = IdempotencyCache(idempotency_config['max_entries'], idempotency_config['ttl_sec'])
 
 def create_kafka_producer():
-    """Initialize and return a Kafka producer with retry logic."""
+    """Initialize and return the sync and batch Kafka producers with retry logic."""
     retry_count = 5
     for attempt in range(retry_count):
         try:
             logger.info("Initializing Kafka client...")
             client = KafkaClient(hosts=f"{kafka_hostname}:{kafka_port}")
             topic = client.topics[str.encode(kafka_topic)]
-            producer = topic.get_sync_producer()
+            # Events are keyed by task uuid, so a task's create and complete
+            # always land on the same partition and stay ordered.
+            if PRODUCER_MODE == 'async':
+                # The publisher queue bounds memory, so block here instead of dropping
+                producer = topic.get_producer(
+                    delivery_reports=True,
+                    linger_ms=PRODUCER_LINGER_MS,
+                    min_queued_messages=PRODUCER_MAX_BATCH_SIZE,
+                    max_queued_messages=PRODUCER_QUEUE_SIZE,
+                    block_on_queue_full=True,
+                    compression=PRODUCER_COMPRESSION,
+                    partitioner=hashing_partitioner
+                )
+            else:
+                producer = topic.get_sync_producer(
+                    compression=PRODUCER_COMPRESSION,
+                    partitioner=hashing_partitioner
+                )
+            # Batch endpoints and the spool drainer enqueue a whole batch and then
+            # wait once for the delivery reports, so the messages go out in one flush.
+            batch_producer = topic.get_producer(
+                delivery_reports=True,
+                linger_ms=BATCH_LINGER_MS,
+                min_queued_messages=BATCH_MAX_ITEMS,
+                max_queued_messages=BATCH_MAX_ITEMS * 10,
+                compression=PRODUCER_COMPRESSION,
+                partitioner=hashing_partitioner
+            )
             logger.info("Kafka client and producer initialized successfully.")
-            return producer
+            return producer, batch_producer
         except Exception as error:  # Catching all exceptions temporarily for robustness
             logger.error("Attempt %d to initialize Kafka client failed: %s", attempt + 1, error)
             if attempt < retry_count - 1:
@@ -75,7 +143,71 @@ def create_kafka_producer():
                 logger.critical("Failed to initialize Kafka client after multiple attempts.")
                 raise
 
-producer = create_kafka_producer()
+producer = None
+batch_producer = None
+publisher = None
+spool = None
+
+def connect_kafka():
+    """Create the producers and, in async mode, the publisher."""
+    global producer, batch_producer, publisher
+    kafka_producer, batch_producer = create_kafka_producer()
+    if PRODUCER_MODE == 'async':
+        publisher = AsyncPublisher(kafka_producer, PRODUCER_QUEUE_SIZE)
+    # Assigned last, since a producer marks the receiver as connected
+    producer = kafka_producer
+
+def run_spool_drainer():
+    """Connect to Kafka in the background, then replay spooled events in order."""
+    while producer is None:
+        try:
+            connect_kafka()
+        except Exception:
+            logger.warning("Kafka unavailable, spooling events and retrying in %d seconds",
+                           SPOOL_RETRY_INTERVAL)
+            sleep(SPOOL_RETRY_INTERVAL)
+
+    logger.info("Starting spool drainer...")
+    while True:
+        records, position = spool.read(SPOOL_DRAIN_BATCH_SIZE)
+        if not records:
+            if position != spool.position:
+                spool.commit(position, 0)
+            sleep(SPOOL_DRAIN_IDLE_SEC)
+            continue
+
+        failures = deliver_batch({message: (trace_id.decode('utf-8'), key) for trace_id, key, message in records})
+        if failures:
+            logger.warning("Failed to replay %d of %d spooled events, retrying in %d seconds",
+                           len(failures), len(records), SPOOL_RETRY_INTERVAL)
+            sleep(SPOOL_RETRY_INTERVAL)
+            continue
+
+        spool.commit(position, len(records))
+        logger.info("Replayed %d spooled events", len(records))
+
+if SPOOL_ENABLED:
+    # Module import no longer waits for the broker: events go to the spool until it is up
+    spool = Spool(
+        spool_config['directory'],
+        spool_config['segment_bytes'],
+        spool_config['max_bytes'],
+        spool_config['fsync_interval_ms'],
+        spool_config['wait_for_fsync']
+    )
+    threading.Thread(target=run_spool_drainer, daemon=True).start()
+else:
+    connect_kafka()
+
+def load_item_validators(spec_file):
+    """Build per-item validators for the batch endpoints from the OpenAPI schemas."""
+    schemas = load_yaml_config(spec_file)['components']['schemas']
+    return {
+        'create': Draft4RequestValidator(schemas['CreateTask'], format_checker=draft4_format_checker),
+        'complete': Draft4RequestValidator(schemas['CompleteTask'], format_checker=draft4_format_checker)
+    }
+
+item_validators = load_item_validators("openapi.yaml")
 
 def tasks():
     """Retrieve and return all tasks from the TASK_FILE."""
@@ -91,26 +223,197 @@ def tasks():
 
     return jsonify(data), 200
 
-def produce_event(event_type, body):
-    """Produce an event message to Kafka."""
+def build_event(event_type, body):
+    """Assign a new trace id to the body and return it with the partition key and encoded message."""
     trace_id = str(uuid.uuid4())
     body['trace_id'] = trace_id
+    msg = {
+        "type": event_type,
+        "datetime": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        "payload": body
+    }
+    return trace_id, body['uuid'].encode('utf-8'), envelope.encode(msg, EVENT_ENCODING)
+
+def should_spool():
+    """Return True when new events must go to the spool to stay behind spooled ones."""
+    return spool is not None and (producer is None or spool.pending())
+
+def spool_event(event_type, trace_id, key, message):
+    """Write an event to the local spool, returning False if the spool is full."""
+    try:
+        spool.append(trace_id.encode('utf-8'), key, message)
+    except SpoolFullError as error:
+        logger.error("Failed to spool event '%s' with trace id %s: %s", event_type, trace_id, error)
+        return False
+    logger.info("Spooled event '%s' with trace id %s", event_type, trace_id)
+    return True
+
+def queue_full_response():
+    """Return the response telling clients to back off and retry."""
+    return (jsonify({"message": "Event queue is full, retry later"}), QUEUE_FULL_STATUS,
+            {"Retry-After": str(QUEUE_FULL_RETRY_AFTER)})
+
+def idempotency_key(event_type, body, header=None):
+    """Return the dedup key: the Idempotency-Key header, else the task uuid, per event type."""
+    return f"{event_type}:{header or body['uuid']}"
+
+def produce_event(event_type, body):
+    """Produce an event message to Kafka, or return the original trace id for a retry."""
+    trace_id, key, message = build_event(event_type, body)
+    dedup_key = idempotency_key(event_type, body, request.headers.get('Idempotency-Key'))
+
+    if idempotency is not None:
+        original_trace_id = idempotency.reserve(dedup_key, trace_id)
+        if original_trace_id is not None:
+            logger.info("Duplicate event '%s' for key %s, returning trace id %s",
+                        event_type, dedup_key, original_trace_id)
+            return jsonify({"trace_id": original_trace_id}), 200, {"Idempotent-Replayed": "true"}
 
     logger.info("Preparing event '%s' with trace id %s", event_type, trace_id)
 
+    error_response = send_event(event_type, trace_id, key, message)
+    if error_response is not None:
+        if idempotency is not None:
+            idempotency.release(dedup_key, trace_id)
+        return error_response
+    return jsonify({"trace_id": trace_id}), 201
+
+def send_event(event_type, trace_id, key, message):
+    """Publish or spool one event, returning an error response if it was not accepted.
+
+    In sync mode with the spool enabled every event is spooled and acknowledged
+    once on disk, so a slow broker holds up the drainer instead of the request.
+    """
+    if should_spool() or (spool is not None and publisher is None):
+        return None if spool_event(event_type, trace_id, key, message) else queue_full_response()
+
     try:
-        msg = {
-            "type": event_type,
-            "datetime": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
-            "payload": body
-        }
-        producer.produce(json.dumps(msg).encode('utf-8'))
-        logger.info("Produced event '%s' with trace id %s", event_type, trace_id)
+        if publisher is not None:
+            publisher.submit(trace_id, message, key)
+            logger.info("Queued event '%s' with trace id %s", event_type, trace_id)
+        else:
+            producer.produce(message, partition_key=key)
+            logger.info("Produced event '%s' with trace id %s", event_type, trace_id)
+    except QueueFullError as error:
+        logger.warning("Rejected event '%s' with trace id %s: %s", event_type, trace_id, error)
+        if spool is not None and spool_event(event_type, trace_id, key, message):
+            return None
+        return queue_full_response()
     except Exception as error:
         logger.error("Failed to produce Kafka message for event '%s': %s", event_type, error)
+        if spool is not None and spool_event(event_type, trace_id, key, message):
+            return None
         return jsonify({"message": "Error producing Kafka message"}), 500
 
-    return NoContent, 201
+    return None
+
+def publish_batch(event_type, messages):
+    """Publish a dict of encoded messages to (trace id, partition key) pairs.
+
+    Returns a dict mapping each message that was not accepted to a (status, reason) pair.
+    """
+    if should_spool():
+        failures = dict.fromkeys(messages, (QUEUE_FULL_STATUS, "Kafka unavailable"))
+    elif publisher is not None:
+        failures = {}
+        for message, (trace_id, key) in messages.items():
+            try:
+                publisher.submit(trace_id, message, key)
+            except QueueFullError as error:
+                failures[message] = (QUEUE_FULL_STATUS, str(error))
+    else:
+        failures = deliver_batch(messages)
+
+    if spool is not None and failures:
+        # Spool in request order so the drainer replays the batch as it was sent
+        for message, (trace_id, key) in messages.items():
+            if message in failures and spool_event(event_type, trace_id, key, message):
+                del failures[message]
+    return failures
+
+def deliver_batch(messages):
+    """Produce messages on the batch producer and wait for their delivery reports.
+
+    Returns a dict mapping each message that was not delivered to a (status, reason) pair.
+    """
+    failures = {}
+    waiting = set()
+    for message, (_, key) in messages.items():
+        try:
+            batch_producer.produce(message, partition_key=key)
+            waiting.add(message)
+        except Exception as error:
+            failures[message] = (500, str(error))
+
+    # Delivery reports are per thread, so only this request's messages show up here
+    deadline = monotonic() + BATCH_DELIVERY_TIMEOUT
+    while waiting:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+        try:
+            report, error = batch_producer.get_delivery_report(timeout=remaining)
+        except Empty:
+            break
+        if report.value in waiting:
+            waiting.discard(report.value)
+            if error is not None:
+                failures[report.value] = (500, str(error))
+
+    for message in waiting:
+        failures[message] = (500, "Delivery not confirmed before timeout")
+    return failures
+
+def produce_batch(event_type, items):
+    """Validate and publish a batch of events, reporting the outcome of each item."""
+    if not items or len(items) > BATCH_MAX_ITEMS:
+        logger.error("Rejected '%s' batch of %d items", event_type, len(items))
+        return jsonify({"message": f"Batch must contain between 1 and {BATCH_MAX_ITEMS} items"}), 400
+
+    validator = item_validators[event_type]
+    results = []
+    pending = {}
+    for index, item in enumerate(items):
+        error = next(validator.iter_errors(item), None)
+        if error is not None:
+            results.append({"index": index, "status": 400, "message": error.message})
+            continue
+        trace_id, key, message = build_event(event_type, item)
+        if idempotency is not None:
+            original_trace_id = idempotency.reserve(idempotency_key(event_type, item), trace_id)
+            if original_trace_id is not None:
+                results.append({"index": index, "status": 200, "trace_id": original_trace_id})
+                continue
+        results.append({"index": index, "status": 201, "trace_id": trace_id})
+        pending[message] = (index, key)
+
+    failures = publish_batch(event_type, {
+        message: (results[index]["trace_id"], key) for message, (index, key) in pending.items()
+    })
+    failed = {}
+    for message, (status, reason) in failures.items():
+        index = pending[message][0]
+        result = results[index]
+        result["status"] = status
+        result["message"] = reason
+        failed[result["trace_id"]] = (status, reason)
+        if idempotency is not None:
+            idempotency.release(idempotency_key(event_type, items[index]), result["trace_id"])
+        logger.error("Failed to produce Kafka message for event '%s' with trace id %s: %s",
+                     event_type, result["trace_id"], reason)
+
+    # A duplicate of an item earlier in this batch shares its outcome, including a failure
+    for result in results:
+        if result["status"] == 200 and result["trace_id"] in failed:
+            result["status"], result["message"] = failed[result["trace_id"]]
+
+    # Duplicates (200) count as accepted, their original event was already produced
+    accepted = sum(1 for result in results if result["status"] in (200, 201))
+    rejected = len(results) - accepted
+    logger.info("Produced '%s' batch: %d accepted, %d rejected", event_type, accepted, rejected)
+
+    response = {"accepted": accepted, "rejected": rejected, "results": results}
+    return jsonify(response), 201 if rejected == 0 else 207
 
 def create(body):
     """Handle the 'create' event."""
@@ -120,6 +423,25 @@ def complete(body):
     """Handle the 'complete' event."""
     return produce_event('complete', body)
 
+def create_batch(body):
+    """Handle a batch of 'create' events."""
+    return produce_batch('create', body)
+
+def complete_batch(body):
+    """Handle a batch of 'complete' events."""
+    return produce_batch('complete', body)
+
+def get_producer_stats():
+    """Return the producer mode, async queue and spool figures, and idempotency cache counts."""
+    stats = {"mode": PRODUCER_MODE, "connected": producer is not None}
+    if publisher is not None:
+        stats.update(publisher.stats())
+    if spool is not None:
+        stats["spool"] = spool.stats()
+    if idempotency is not None:
+        stats["idempotency"] = idempotency.stats()
+    return jsonify(stats), 200
+
 def get_check():
     return NoContent, 200
 
@@ -0,0 +1,68 @@
+"""
+This script compares the JSON and binary event envelopes.
+
+It reports the encoded size of each event type and the encode and decode
+throughput of each encoding. Run it from the receiver directory:
+
+    python3 benchmark_envelope.py [iterations]
+"""
+
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+import envelope
+
+SAMPLE_EVENTS = {
+    'create': {
+        "uuid": str(uuid.uuid4()),
+        "task_name": "1yfgep2hea",
+        "due_date": "2024-11-07T11:23:53.837Z",
+        "task_description": "lab3",
+        "task_difficulty": 2,
+        "trace_id": str(uuid.uuid4())
+    },
+    'complete': {
+        "task_name": "ne0abiwftj",
+        "uuid": str(uuid.uuid4()),
+        "completed_at": "2024-11-07T11:23:53.856Z",
+        "completion_status": True,
+        "completed_by": "something",
+        "task_difficulty": 8,
+        "trace_id": str(uuid.uuid4())
+    }
+}
+
+
+def measure(func, iterations):
+    """
+    Returns the best-of-three throughput of func in calls per second.
+    """
+    best = min(timeit.repeat(func, number=iterations, repeat=3))
+    return iterations / best
+
+
+def main():
+    """
+    Prints size and throughput figures for each event type and encoding.
+    """
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"{'event':<10}{'encoding':<10}{'bytes':>8}{'encode/s':>14}{'decode/s':>14}")
+
+    for event_type, payload in SAMPLE_EVENTS.items():
+        msg = {
+            "type": event_type,
+            "datetime": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+            "payload": payload
+        }
+        for encoding in ('json', 'binary'):
+            raw = envelope.encode(msg, encoding)
+            assert envelope.decode(raw) == msg
+            encode_rate = measure(lambda: envelope.encode(msg, encoding), iterations)
+            decode_rate = measure(lambda: envelope.decode(raw), iterations)
+            print(f"{event_type:<10}{encoding:<10}{len(raw):>8}{encode_rate:>14,.0f}{decode_rate:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
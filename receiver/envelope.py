@@ -0,0 +1,71 @@
+"""
+This module encodes and decodes the event envelope carried on the events topic.
+
+Two encodings share the topic. The legacy one is the JSON document
+{"type", "datetime", "payload"}. The binary one is a two byte header (magic,
+version) followed by a MessagePack array that lists the payload values in a
+fixed order per event type, so no field names travel with each event.
+"""
+
+import json
+import msgpack
+
+# 0xB7 is a UTF-8 continuation byte, so it can never start a JSON document
+MAGIC = 0xB7
+VERSION = 1
+HEADER = bytes((MAGIC, VERSION))
+
+# Event types by wire code, and the payload fields of each in wire order
+EVENT_TYPES = ('create', 'complete')
+TYPE_CODES = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+FIELDS = {
+    'create': ('uuid', 'trace_id', 'task_name', 'due_date', 'task_description',
+               'task_difficulty'),
+    'complete': ('uuid', 'trace_id', 'task_name', 'completed_at', 'completion_status',
+                 'completed_by', 'task_difficulty')
+}
+FIELD_SETS = {event_type: frozenset(fields) for event_type, fields in FIELDS.items()}
+
+
+def encode(msg, encoding='json'):
+    """
+    Encodes an event message, using the binary envelope when asked and the type is known.
+    """
+    if encoding == 'binary' and msg['type'] in TYPE_CODES:
+        return encode_binary(msg)
+    return json.dumps(msg).encode('utf-8')
+
+
+def encode_binary(msg):
+    """
+    Encodes an event message as a versioned MessagePack array.
+    """
+    event_type = msg['type']
+    payload = msg['payload']
+    fields = FIELDS[event_type]
+    values = [TYPE_CODES[event_type], msg['datetime']]
+    values += [payload.get(name) for name in fields]
+
+    # Fields outside the schema are kept in a trailing map
+    if not FIELD_SETS[event_type].issuperset(payload):
+        values.append({name: value for name, value in payload.items() if name not in fields})
+    return HEADER + msgpack.packb(values)
+
+
+def decode(raw):
+    """
+    Decodes an event message in either encoding.
+    """
+    if raw[0] != MAGIC:
+        return json.loads(raw.decode('utf-8'))
+    if raw[1] != VERSION:
+        raise ValueError(f"Unsupported event envelope version {raw[1]}")
+
+    values = msgpack.unpackb(raw[2:])
+    event_type = EVENT_TYPES[values[0]]
+    fields = FIELDS[event_type]
+    payload = {name: value for name, value in zip(fields, values[2:]) if value is not None}
+    if len(values) > len(fields) + 2:
+        payload.update(values[-1])
+    return {"type": event_type, "datetime": values[1], "payload": payload}
+
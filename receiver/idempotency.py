@@ -0,0 +1,65 @@
+"""
+This module provides a bounded LRU/TTL cache of idempotency keys for the receiver service.
+"""
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class IdempotencyCache:
+    """
+    Remembers the trace id assigned to each idempotency key.
+
+    Entries expire after ttl_sec and the least recently used entry is evicted
+    once max_entries is reached. A key is reserved before its event is
+    produced, so a retry that races the original request is also caught.
+    """
+
+    def __init__(self, max_entries, ttl_sec):
+        """
+        Initializes an empty cache.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl_sec
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def reserve(self, key, trace_id):
+        """
+        Records trace_id for key, or returns the trace id already recorded for it.
+        """
+        now = monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.counts["hits"] += 1
+                return entry[0]
+
+            self.counts["misses"] += 1
+            self.entries[key] = (trace_id, now + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counts["evictions"] += 1
+            return None
+
+    def release(self, key, trace_id):
+        """
+        Forgets a reservation whose event could not be accepted, so a retry can produce it.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == trace_id:
+                del self.entries[key]
+
+    def stats(self):
+        """
+        Returns the cache size and hit, miss and eviction counts.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats["entries"] = len(self.entries)
+        return stats
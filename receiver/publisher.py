@@ -0,0 +1,132 @@
+"""
+This module provides a background Kafka publisher with a bounded in-memory queue.
+"""
+
+import logging
+import threading
+from collections import deque
+from queue import Queue, Full, Empty
+from time import monotonic
+
+logger = logging.getLogger('basicLogger')
+
+# Number of recent delivery latencies kept for the percentile figures
+LATENCY_WINDOW = 1000
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the publisher queue has no room for another event.
+    """
+
+
+class AsyncPublisher:
+    """
+    Hands events to an async pykafka producer from a single background thread.
+
+    Requests only pay for a non-blocking queue insert. The producer batches the
+    messages (linger time, batch size, compression) and the delivery reports are
+    read back on the same thread, since pykafka keeps them per producing thread.
+    """
+
+    def __init__(self, producer, max_queue_size, report_interval_ms=100):
+        """
+        Initializes the publisher and starts its background thread.
+        """
+        self.producer = producer
+        self.max_queue_size = max_queue_size
+        self.report_interval = report_interval_ms / 1000
+        self.queue = Queue(maxsize=max_queue_size)
+        self.in_flight = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+        self.counts = {"submitted": 0, "delivered": 0, "failed": 0, "rejected": 0}
+
+        self.thread = threading.Thread(target=self._run, name="kafka-publisher", daemon=True)
+        self.thread.start()
+
+    def submit(self, trace_id, message, partition_key=None):
+        """
+        Queues an encoded message for publishing, raising QueueFullError when saturated.
+        """
+        try:
+            self.queue.put_nowait((trace_id, message, partition_key, monotonic()))
+        except Full:
+            with self.lock:
+                self.counts["rejected"] += 1
+            raise QueueFullError(f"Publisher queue is full ({self.max_queue_size} events)")
+        with self.lock:
+            self.counts["submitted"] += 1
+
+    def _run(self):
+        """
+        Moves queued events into the producer and processes delivery reports.
+        """
+        while True:
+            try:
+                trace_id, message, partition_key, enqueued_at = self.queue.get(timeout=self.report_interval)
+            except Empty:
+                self._drain_reports()
+                continue
+
+            try:
+                self.producer.produce(message, partition_key=partition_key)
+                self.in_flight[message] = (trace_id, enqueued_at)
+            except Exception as error:
+                self._on_delivery(trace_id, enqueued_at, error)
+            self._drain_reports()
+
+    def _drain_reports(self):
+        """
+        Processes every delivery report that is ready without blocking.
+        """
+        while True:
+            try:
+                report, error = self.producer.get_delivery_report(block=False)
+            except Empty:
+                return
+            trace_id, enqueued_at = self.in_flight.pop(report.value, (None, None))
+            if enqueued_at is not None:
+                self._on_delivery(trace_id, enqueued_at, error)
+
+    def _on_delivery(self, trace_id, enqueued_at, error):
+        """
+        Records the outcome of one event and logs failures by trace id.
+        """
+        latency_ms = (monotonic() - enqueued_at) * 1000
+        with self.lock:
+            if error is None:
+                self.counts["delivered"] += 1
+                self.latencies.append(latency_ms)
+            else:
+                self.counts["failed"] += 1
+        if error is not None:
+            logger.error("Delivery failed for event with trace id %s: %s", trace_id, error)
+
+    def stats(self):
+        """
+        Returns queue depth, delivery counts and recent delivery latency figures.
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = dict(self.counts)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["queue_capacity"] = self.max_queue_size
+        stats["in_flight"] = len(self.in_flight)
+        stats["delivery_latency_ms"] = {
+            "avg": sum(latencies) / len(latencies) if latencies else 0,
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0
+        }
+        return stats
+
+
+def percentile(sorted_values, pct):
+    """
+    Returns the nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0
+    rank = max(0, int(round(pct / 100 * len(sorted_values))) - 1)
+    return sorted_values[rank]
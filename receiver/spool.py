@@ -0,0 +1,255 @@
+"""
+This module provides an append-only, segment-rotated spool of events on local disk.
+"""
+
+import logging
+import os
+import struct
+import threading
+import zlib
+from time import sleep
+
+logger = logging.getLogger('basicLogger')
+
+# Each record is framed as: body length, crc32 of the body, then the body.
+# The body is a sequence of length-prefixed fields.
+FRAME_HEADER = struct.Struct('>II')
+FIELD_HEADER = struct.Struct('>I')
+SEGMENT_PREFIX = 'spool-'
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT_FILE = 'checkpoint'
+
+
+class SpoolFullError(Exception):
+    """
+    Raised when the spool has reached its configured size limit.
+    """
+
+
+class Spool:
+    """
+    Stores records in numbered segment files and replays them in order.
+
+    Writers append to the newest segment, which is rotated once it grows past
+    segment_bytes. Appends are made durable by a background thread that fsyncs at
+    most every fsync_interval_ms, so concurrent writers share one fsync. When
+    wait_for_fsync is set, append only returns once its record is on disk.
+    The reader position is kept in a checkpoint file and segments are deleted
+    once every record in them has been committed.
+    """
+
+    def __init__(self, directory, segment_bytes, max_bytes, fsync_interval_ms, wait_for_fsync=True):
+        """
+        Opens the spool directory, recovering existing segments and the checkpoint.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.wait_for_fsync = wait_for_fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        self.written_seq = 0
+        self.synced_seq = 0
+        self.counts = {"appended": 0, "committed": 0}
+
+        segments = self._segments()
+        self.total_bytes = sum(os.path.getsize(self._path(number)) for number in segments)
+        self.position = self._load_checkpoint(segments)
+
+        # Never append to a recovered segment, its tail may hold a torn write
+        self.active = (segments[-1] + 1) if segments else 1
+        self.file = open(self._path(self.active), 'ab')
+        self.active_size = 0
+        if segments:
+            logger.info("Recovered spool with %d segments (%d bytes) from '%s'",
+                        len(segments), self.total_bytes, directory)
+
+        self.flusher = threading.Thread(target=self._flush_loop, name="spool-fsync", daemon=True)
+        self.flusher.start()
+
+    def _path(self, number):
+        """
+        Returns the file path of a segment.
+        """
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        """
+        Returns the numbers of the segments on disk in ascending order.
+        """
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(numbers)
+
+    def _load_checkpoint(self, segments):
+        """
+        Returns the committed (segment, offset) read position.
+        """
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                segment, offset = (int(value) for value in file.read().split())
+            return segment, offset
+        return (segments[0] if segments else 1), 0
+
+    def append(self, *fields):
+        """
+        Appends one record made of the given byte fields.
+        """
+        body = b''.join(FIELD_HEADER.pack(len(field)) + field for field in fields)
+        frame = FRAME_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+        with self.lock:
+            if self.total_bytes + len(frame) > self.max_bytes:
+                raise SpoolFullError(f"Spool is full ({self.total_bytes} of {self.max_bytes} bytes)")
+            if self.active_size and self.active_size + len(frame) > self.segment_bytes:
+                self._rotate()
+            self.file.write(frame)
+            self.file.flush()
+            self.active_size += len(frame)
+            self.total_bytes += len(frame)
+            self.counts["appended"] += 1
+            self.written_seq += 1
+            seq = self.written_seq
+
+            if self.wait_for_fsync:
+                while self.synced_seq < seq:
+                    self.synced.wait()
+
+    def _rotate(self):
+        """
+        Seals the active segment and starts a new one. Called with the lock held.
+        """
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.synced_seq = self.written_seq
+        self.synced.notify_all()
+        self.active += 1
+        self.file = open(self._path(self.active), 'ab')
+        self.active_size = 0
+
+    def _flush_loop(self):
+        """
+        Fsyncs the active segment whenever new records were written.
+        """
+        while True:
+            sleep(self.fsync_interval)
+            with self.lock:
+                if self.synced_seq == self.written_seq:
+                    continue
+                target = self.written_seq
+                fd = os.dup(self.file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            with self.lock:
+                self.synced_seq = max(self.synced_seq, target)
+                self.synced.notify_all()
+
+    def pending(self):
+        """
+        Returns True when there are records that have not been committed yet.
+        """
+        with self.lock:
+            return self.position != (self.active, self.active_size)
+
+    def read(self, max_records):
+        """
+        Returns up to max_records records after the committed position and the
+        position just past them, to be passed to commit once they are handled.
+        """
+        with self.lock:
+            active, active_size = self.active, self.active_size
+        segment, offset = self.position
+        records = []
+
+        while len(records) < max_records:
+            if segment > active:
+                break
+            limit = active_size if segment == active else None
+            if not os.path.exists(self._path(segment)):
+                segment, offset = segment + 1, 0
+                continue
+            offset, complete = self._read_segment(segment, offset, limit, max_records - len(records), records)
+            if segment == active or not complete:
+                break
+            segment, offset = segment + 1, 0
+
+        return records, (segment, offset)
+
+    def _read_segment(self, segment, offset, limit, max_records, records):
+        """
+        Reads records from one segment starting at offset into records.
+
+        Returns the offset after the last full record and whether the segment
+        was read to its end.
+        """
+        with open(self._path(segment), 'rb') as file:
+            file.seek(offset)
+            while max_records > 0 and (limit is None or offset < limit):
+                header = file.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    return offset, True
+                length, crc = FRAME_HEADER.unpack(header)
+                body = file.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    # A torn or corrupt tail can only be left behind by a crash
+                    logger.error("Skipping corrupt spool record in segment %d at offset %d", segment, offset)
+                    return offset, True
+                records.append(self._split_fields(body))
+                offset += FRAME_HEADER.size + length
+                max_records -= 1
+            return offset, limit is not None and offset >= limit
+
+    @staticmethod
+    def _split_fields(body):
+        """
+        Splits a record body into its fields.
+        """
+        fields = []
+        index = 0
+        while index < len(body):
+            (length,) = FIELD_HEADER.unpack_from(body, index)
+            index += FIELD_HEADER.size
+            fields.append(body[index:index + length])
+            index += length
+        return tuple(fields)
+
+    def commit(self, position, count):
+        """
+        Persists a read position and deletes the segments before it.
+        """
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(f"{position[0]} {position[1]}")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+
+        with self.lock:
+            self.position = position
+            self.counts["committed"] += count
+            for number in self._segments():
+                if number >= position[0]:
+                    break
+                self.total_bytes -= os.path.getsize(self._path(number))
+                os.remove(self._path(number))
+
+    def stats(self):
+        """
+        Returns the spool size and record counts.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats["bytes"] = self.total_bytes
+            stats["max_bytes"] = self.max_bytes
+            stats["active_segment"] = self.active
+            stats["pending"] = self.position != (self.active, self.active_size)
+        return stats
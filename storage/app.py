@@ -1,10 +1,10 @@
 import connexion
 from connexion import NoContent
-from flask import jsonify, request
-import json
-from datetime import datetime
+from flask import jsonify, request, Response
+from datetime import datetime, timedelta
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import func, select
+from sqlalchemy.exc import InterfaceError, OperationalError
 from sqlalchemy.orm import sessionmaker
 from create import Create
 from complete import Complete
@@ -13,8 +13,22 @@ import yaml
 import logging
 import logging.config
 import threading
+from time import monotonic
 from pykafka import KafkaClient
 from pykafka.common import OffsetType
+import envelope
+from writer import store_batch, store_rows, event_row, create_row, complete_row, counter_increments, increment_counters, BatchStats
+from counter import EventCounter, HOUR_FORMAT
+from db import create_db_engine, pool_stats
+from workers import WorkerPool
+from deadletter import DeadLetterQueue, POISON_ERRORS, supervise
+from consumer_metrics import ConsumerMetrics
+from pagination import keyset_select, fetch_page, stream_ndjson, RESPONSE_VALIDATOR_MAP
+from records import TASK_FIELDS, COMPLETED_TASK_FIELDS, task_records, completed_task_records, dumps
+from archive import archive_rows, date_bucket, range_conditions, read_source
+from query_cache import query_cache, touch, invalidate_on_commit
+from replicas import ReplicaRouter
+from apscheduler.schedulers.background import BackgroundScheduler
 
 # Determine configuration file paths based on environment
 if "TARGET_ENV" in os.environ and os.environ["TARGET_ENV"] == "test":
@@ -46,63 +60,182 @@ MAX_EVENTS = 5
 
 # Database configuration
 db_config = app_config['datastore']
-logger.info(f"Connecting to MySQL database on host '{db_config['hostname']}' and port '{db_config['port']}'.")
-DATABASE_URL = f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['hostname']}:{db_config['port']}/{db_config['db']}"
-engine = create_engine(DATABASE_URL)
+logger.info(f"Connecting to MySQL database on host '{db_config.get('hostname')}' and port '{db_config.get('port')}'.")
+engine = create_db_engine(db_config)
 Session = sessionmaker(bind=engine)
+invalidate_on_commit(Session)
+
+# Read replicas for the GET endpoints
+replica_router = ReplicaRouter(engine, db_config)
 
 # Kafka configuration
 KAFKA_HOST = f"{app_config['events']['hostname']}:{app_config['events']['port']}"
 KAFKA_TOPIC = app_config['events']['topic']
 
-# API tasks
-def tasks():
+# Kafka consumer configuration
+consumer_config = app_config['consumer']
+CONSUMER_MODE = consumer_config['mode']
+CONSUMER_BATCH_SIZE = consumer_config['batch_size']
+CONSUMER_FLUSH_MS = consumer_config['flush_ms']
+CONSUMER_WORKERS = consumer_config.get('workers', 4)
+CONSUMER_WORKER_QUEUE_SIZE = consumer_config.get('worker_queue_size', 1000)
+CONSUMER_COMMIT_INTERVAL_MS = consumer_config.get('commit_interval_ms', 1000)
+CONSUMER_RESTART_BACKOFF_MS = consumer_config.get('restart_backoff_ms', 1000)
+CONSUMER_MAX_RESTART_BACKOFF_MS = consumer_config.get('max_restart_backoff_ms', 60000)
+
+# Dead-letter configuration
+dead_letter_config = app_config['dead_letter']
+dead_letters = DeadLetterQueue(
+    dead_letter_config['filepath'],
+    KAFKA_TOPIC,
+    max_retries=dead_letter_config['max_retries'],
+    backoff_ms=dead_letter_config['backoff_ms']
+)
+
+# Archival configuration
+archive_config = app_config['archive']
+ARCHIVE_RETENTION_DAYS = archive_config['retention_days']
+ARCHIVE_INTERVAL_HOURS = archive_config['interval_hours']
+
+# Query cache configuration
+query_cache.configure(**app_config['query_cache'])
+query_cache.share(engine)
+
+# Minute bucket format of the aggregates breakdown, which sorts in time order
+MINUTE_FORMAT = "%Y-%m-%dT%H:%M"
+
+# Rows written less than this long ago are left out of id cursor reads
+AGGREGATES_CURSOR_SETTLE = timedelta(seconds=app_config['aggregates']['cursor_settle_sec'])
+
+batch_stats = BatchStats()
+consumer_metrics = ConsumerMetrics(consumer_config['lag_warning'], consumer_config['lag_critical'])
+worker_pool = None
+
+def parse_timestamp(timestamp):
     """
-    Retrieve tasks from the database with optional timestamp filtering.
+    Parses a query timestamp, accepting a trailing 'Z' for UTC.
     """
-    logger.info("assignment 3.")
-    session = Session()
+    if 'Z' in timestamp:
+        timestamp = timestamp.replace('Z', '+00:00')
+    return datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S%z")
+
+
+def timestamp_window():
+    """
+    Returns the (start, end) of the optional start_timestamp/end_timestamp query parameters.
+    """
+    start_timestamp = request.args.get('start_timestamp')
+    end_timestamp = request.args.get('end_timestamp')
+    start = parse_timestamp(start_timestamp) if start_timestamp else None
+    end = parse_timestamp(end_timestamp) if end_timestamp else None
+    return start, end
+
+
+def read_session(primary=False):
+    """
+    Returns a session on the engine the read endpoints should use, or on the
+    primary, and how many seconds its data can be behind the primary.
+    """
+    read_engine, staleness_sec = replica_router.route(primary)
+    return Session(bind=read_engine), staleness_sec
+
+
+def list_rows(table, fields, to_records, label):
+    """
+    Returns the rows of a table in (date_created, id) order, either as one JSON
+    page with an X-Next-Cursor header when more rows remain, or streamed as NDJSON.
+
+    Only the returned fields are selected, as plain rows rather than ORM objects,
+    from the live table plus the archive tables the time window reaches into,
+    on a read replica when one is close enough to the primary. Pages of windows
+    that have ended are served from the query cache.
+    """
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    stream = request.args.get('stream', 'false').lower() == 'true'
+
     try:
-        start_timestamp = request.args.get('start_timestamp')
-        end_timestamp = request.args.get('end_timestamp')
-
-        query = session.query(Create)
-
-        # Handle timestamp filtering with 'Z' handling
-        if start_timestamp:
-            if 'Z' in start_timestamp:
-                start_timestamp = start_timestamp.replace('Z', '+00:00')
-            start_dt = datetime.strptime(start_timestamp, "%Y-%m-%dT%H:%M:%S%z")
-            query = query.filter(Create.date_created >= start_dt)
-
-        if end_timestamp:
-            if 'Z' in end_timestamp:
-                end_timestamp = end_timestamp.replace('Z', '+00:00')
-            end_dt = datetime.strptime(end_timestamp, "%Y-%m-%dT%H:%M:%S%z")
-            query = query.filter(Create.date_created < end_dt)
-
-        tasks_list = query.all()
-        tasks_data = [
-            {
-                'trace_id': task.trace_id,
-                'task_name': task.task_name,
-                'due_date': task.due_date,
-                'task_description': task.task_description,
-                'task_difficulty': task.task_difficulty,
-                'uuid': task.uuid,
-                'date_created': task.date_created.isoformat()
-            }
-            for task in tasks_list
-        ]
-
-        logger.info("Tasks retrieved: %d tasks", len(tasks_data))
-        return jsonify(tasks_data), 200
+        start, end = timestamp_window()
+    except ValueError as e:
+        return Response(str(e), 400, mimetype='text/plain')
+
+    cache_key = None
+    if not stream:
+        if query_cache.cacheable(end):
+            cache_key = query_cache.key(table.name, start, end, cursor, limit)
+            entry = query_cache.get(cache_key)
+            if entry is not None:
+                logger.info("%s served from cache", label.capitalize())
+                return page_response(entry.body, entry.next_cursor, "HIT")
+            # Taken before reading, so a write committed meanwhile keeps the page out
+            read_started = query_cache.read_started()
+        else:
+            query_cache.count_uncacheable()
+
+    # Routed after the cache lookup, so the read counts are of database reads only
+    session, staleness_sec = read_session()
+    if cache_key is not None and not query_cache.cacheable(end, staleness_sec):
+        # The replica may not have all the rows of the window yet
+        cache_key = None
+
+    try:
+        source = read_source(session, table, start, end)
+        statement = select([source.c[field] for field in fields] + [source.c.id])
+        for condition in range_conditions(source.c, start, end):
+            statement = statement.where(condition)
+        statement = keyset_select(statement, source.c, cursor)
+    except ValueError as e:
+        # Malformed timestamps and cursors
+        session.close()
+        return Response(str(e), 400, mimetype='text/plain')
     except Exception as e:
-        logger.error(f"Error retrieving tasks: {str(e)}")
-        return "Error retrieving tasks", 500
+        # The archive catalog lookup reads the database
+        logger.error(f"Error retrieving {label}: {str(e)}")
+        session.close()
+        return Response(f"Error retrieving {label}", 500, mimetype='text/plain')
+
+    if stream:
+        if limit:
+            statement = statement.limit(limit)
+        logger.info("Streaming %s", label)
+        # The generator owns the session from here and closes it when done
+        return Response(stream_ndjson(session, statement, to_records), 200, mimetype='application/x-ndjson')
+
+    try:
+        rows, next_cursor = fetch_page(session, statement, limit)
+        logger.info("%s retrieved: %d %s", label.capitalize(), len(rows), label)
+        body = dumps(to_records(rows))
+        if cache_key is None:
+            return page_response(body, next_cursor)
+        query_cache.put(cache_key, start, end, body, next_cursor, read_started, staleness_sec)
+        return page_response(body, next_cursor, "MISS")
+    except Exception as e:
+        logger.error(f"Error retrieving {label}: {str(e)}")
+        return Response(f"Error retrieving {label}", 500, mimetype='text/plain')
     finally:
         session.close()
 
+
+def page_response(body, next_cursor, cache_status=None):
+    """
+    Returns a JSON page, with the cursor of the next page and the cache status when there are any.
+    """
+    response = Response(body, 200, mimetype='application/json')
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    if cache_status:
+        response.headers['X-Cache'] = cache_status
+    return response
+
+
+# API tasks
+def tasks():
+    """
+    Retrieve tasks from the database with optional timestamp filtering and paging.
+    """
+    logger.info("assignment 3.")
+    return list_rows(Create.__table__, TASK_FIELDS, task_records, "tasks")
+
 def create(body):
     """
     Create a new task in the database.
@@ -123,16 +256,17 @@ def create(body):
     if not provided_uuid:
         return "Error: 'uuid' is required in the body.", 400
 
-    new_task = Create(
-        trace_id=trace_id,
-        task_name=task_name,
-        due_date=due_date,
-        task_description=task_description,
-        task_difficulty=task_difficulty,
-        uuid=provided_uuid
-    )
-
-    session.add(new_task)
+    new_task = {
+        'trace_id': trace_id,
+        'task_name': task_name,
+        'due_date': due_date,
+        'task_description': task_description,
+        'task_difficulty': task_difficulty,
+        'uuid': provided_uuid
+    }
+
+    # Upsert on uuid, so a repeated request does not add a second row
+    store_rows(session, 'create', [create_row(new_task, datetime.now())])
     session.commit()
 
     # Log the trace ID
@@ -162,28 +296,25 @@ def complete(body):
     # Find the task name in the task table
     task_found = session.query(Create).filter(Create.task_name == task_name_to_complete).first()
 
+    completed_task = {
+        'trace_id': trace_id,
+        'task_name': task_name_to_complete,
+        'task_difficulty': task_found.task_difficulty if task_found else None,
+        'uuid': provided_uuid,
+        'completed_by': completed_by,
+        'task_created_at': task_found.date_created if task_found else None
+    }
+    store_rows(session, 'complete', [complete_row(completed_task, datetime.now())])
+
     if task_found:
-        completed_task = Complete(
-            trace_id=trace_id,
-            task_name=task_name_to_complete,
-            task_difficulty=task_found.task_difficulty,
-            uuid=provided_uuid,
-            completed_by=completed_by
-        )
-
-        session.add(completed_task)
+        # The task leaves the tasks table, so it leaves its counters too
+        removed = {'task_difficulty': task_found.task_difficulty, 'date_created': task_found.date_created}
+        increment_counters(session, counter_increments('create', [removed], sign=-1))
+        touch(session, Create.__tablename__, [task_found.date_created])
         session.delete(task_found)
         response_message = f"Task '{task_name_to_complete}' updated and completed"
     else:
         # If it doesn't find an existing task name, create a new task in the completed table
-        completed_task = Complete(
-            trace_id=trace_id,
-            task_name=task_name_to_complete,
-            uuid=provided_uuid,
-            task_difficulty=None,
-            completed_by=completed_by
-        )
-        session.add(completed_task)
         response_message = f"Task '{task_name_to_complete}' created and completed"
 
     session.commit()
@@ -197,80 +328,143 @@ def complete(body):
 
 def completed_tasks():
     """
-    Retrieve completed tasks from the database with optional timestamp filtering.
+    Retrieve completed tasks from the database with optional timestamp filtering and paging.
     """
-    session = Session()
-    try:
-        start_timestamp = request.args.get('start_timestamp')
-        end_timestamp = request.args.get('end_timestamp')
-
-        query = session.query(Complete)
-
-        # Handle timestamp filtering with 'Z' handling
-        if start_timestamp:
-            if 'Z' in start_timestamp:
-                start_timestamp = start_timestamp.replace('Z', '+00:00')
-            start_dt = datetime.strptime(start_timestamp, "%Y-%m-%dT%H:%M:%S%z")
-            query = query.filter(Complete.date_created >= start_dt)
-
-        if end_timestamp:
-            if 'Z' in end_timestamp:
-                end_timestamp = end_timestamp.replace('Z', '+00:00')
-            end_dt = datetime.strptime(end_timestamp, "%Y-%m-%dT%H:%M:%S%z")
-            query = query.filter(Complete.date_created < end_dt)
-
-        completed_tasks_list = query.all()
-        completed_tasks_data = [
-            {
-                'trace_id': task.trace_id,
-                'task_name': task.task_name,
-                'task_difficulty': task.task_difficulty,
-                'uuid': task.uuid,
-                'completed_by': task.completed_by,
-                'date_created': task.date_created.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            for task in completed_tasks_list
-        ]
-
-        logger.info("Completed tasks retrieved: %d tasks", len(completed_tasks_data))
-        return jsonify(completed_tasks_data), 200
-    except Exception as e:
-        logger.error(f"Error retrieving completed tasks: {str(e)}")
-        return "Error retrieving completed tasks", 500
-    finally:
-        session.close()
+    return list_rows(Complete.__table__, COMPLETED_TASK_FIELDS, completed_task_records, "completed tasks")
 
 def process_messages():
     """
     Process incoming messages from Kafka and store them in the database.
     """
     logger.info("Initializing Kafka consumer...")
-    try:
-        client = KafkaClient(hosts=KAFKA_HOST)
-        topic = client.topics[KAFKA_TOPIC.encode('utf-8')]
-        consumer = topic.get_simple_consumer(
-            consumer_group=b'event_group',
-            reset_offset_on_start=False,
-            auto_offset_reset=OffsetType.LATEST
-        )
+    client = KafkaClient(hosts=KAFKA_HOST)
+    topic = client.topics[KAFKA_TOPIC.encode('utf-8')]
+    consumer_metrics.watch(topic)
+    # A balanced consumer shares the topic's partitions among every replica
+    # in the group; events are keyed by task uuid, so per-task order holds.
+    consumer = topic.get_balanced_consumer(
+        consumer_group=b'event_group',
+        managed=True,
+        reset_offset_on_start=False,
+        auto_offset_reset=OffsetType.LATEST,
+        consumer_timeout_ms=CONSUMER_FLUSH_MS if CONSUMER_MODE in ('batch', 'workers') else -1
+    )
 
+    # Leave the group on the way out so a restart gets the partitions back at once
+    try:
         logger.info("Starting Kafka consumer...")
-        for msg in consumer:
+        if CONSUMER_MODE == 'batch':
+            process_batches(consumer)
+        elif CONSUMER_MODE == 'workers':
+            process_with_workers(consumer)
+        else:
+            for msg in consumer:
+                if msg is not None:
+                    started = monotonic()
+                    dead_letters.handle(msg, store_message)
+                    consumer_metrics.record([msg], monotonic() - started)
+                    # Commit message offsets
+                    consumer_metrics.commit(consumer)
+    finally:
+        consumer.stop()
+
+def process_batches(consumer):
+    """
+    Consume messages in micro-batches of up to CONSUMER_BATCH_SIZE messages or
+    CONSUMER_FLUSH_MS, write each batch in one transaction and then commit offsets.
+    """
+    flush_seconds = CONSUMER_FLUSH_MS / 1000
+    while True:
+        msgs = []
+        deadline = monotonic() + flush_seconds
+        while len(msgs) < CONSUMER_BATCH_SIZE and monotonic() < deadline:
+            # Returns None once the consumer timeout passes without a message
+            msg = consumer.consume(block=True)
             if msg is not None:
-                msg_str = msg.value.decode('utf-8')
-                event_msg = json.loads(msg_str)
-                logger.info(f"Message received: {event_msg}")
-
-                # Process events based on their type
-                if event_msg["type"] == "create":
-                    store_event1(event_msg["payload"])
-                elif event_msg["type"] == "complete":
-                    store_event2(event_msg["payload"])
-
-                # Commit message offsets
-                consumer.commit_offsets()
+                msgs.append(msg)
+
+        if not msgs:
+            continue
+
+        started = monotonic()
+        written = store_messages(msgs)
+        elapsed = monotonic() - started
+        batch_stats.record(written, elapsed)
+        consumer_metrics.record(msgs, elapsed)
+        consumer_metrics.commit(consumer)
+        logger.info(f"Stored batch of {written} events in {elapsed * 1000:.1f} ms")
+
+def process_with_workers(consumer):
+    """
+    Consume messages on this thread and write them on CONSUMER_WORKERS writer
+    threads sharded by task uuid, committing offsets up to what has been written.
+    """
+    global worker_pool
+    worker_pool = WorkerPool(
+        store_messages,
+        consumer_metrics,
+        workers=CONSUMER_WORKERS,
+        queue_size=CONSUMER_WORKER_QUEUE_SIZE,
+        batch_size=CONSUMER_BATCH_SIZE,
+        commit_interval_ms=CONSUMER_COMMIT_INTERVAL_MS
+    )
+    logger.info(f"Started {CONSUMER_WORKERS} storage writer threads")
+    try:
+        worker_pool.run(consumer)
+    finally:
+        worker_pool.stop()
+
+def store_messages(msgs):
+    """
+    Store a batch of messages with bulk inserts in a single transaction.
+    Messages that cannot be turned into rows are dead-lettered. If the batch
+    fails, the messages are stored one by one so a bad one only loses itself,
+    unless the database could not be reached: then the error is raised, so
+    the consumer restarts and fetches the batch again.
+    """
+    now = datetime.now()
+    groups = {}
+    stored = []
+    for msg in msgs:
+        try:
+            event_type, row = event_row(envelope.decode(msg.value), now)
+        except POISON_ERRORS as e:
+            dead_letters.put(msg, e)
+            continue
+        groups.setdefault(event_type, []).append(row)
+        stored.append(msg)
+
+    session = Session()
+    try:
+        written = store_batch(session, groups)
+        session.commit()
+        return written
+    except (OperationalError, InterfaceError) as e:
+        logger.error(f"Database unavailable storing batch of {len(stored)} events: {str(e)}")
+        session.rollback()
+        raise
     except Exception as e:
-        logger.error(f"Error in Kafka consumer: {str(e)}")
+        logger.error(f"Error storing batch of {len(stored)} events, retrying one by one: {str(e)}")
+        session.rollback()
+    finally:
+        session.close()
+
+    return sum(dead_letters.handle(msg, store_message) for msg in stored)
+
+def store_message(msg):
+    """
+    Store the event of one message, raising if it cannot be stored.
+    """
+    event_msg = envelope.decode(msg.value)
+    logger.info(f"Message received: {event_msg}")
+
+    # Process events based on their type
+    if event_msg["type"] == "create":
+        store_event1(event_msg["payload"])
+    elif event_msg["type"] == "complete":
+        store_event2(event_msg["payload"])
+    else:
+        raise ValueError(f"Unknown event type {event_msg['type']!r}")
 
 def store_event1(payload):
     """
@@ -278,20 +472,13 @@ def store_event1(payload):
     """
     session = Session()
     try:
-        new_event = Create(
-            trace_id=payload['trace_id'],
-            task_name=payload['task_name'],
-            due_date=payload['due_date'],
-            task_description=payload['task_description'],
-            task_difficulty=payload['task_difficulty'],
-            uuid=payload['uuid']
-        )
-        session.add(new_event)
+        store_rows(session, 'create', [create_row(payload, datetime.now())])
         session.commit()
         logger.info(f"Stored event1 with trace ID: {payload['trace_id']}")
     except Exception as e:
         logger.error(f"Error storing event1: {str(e)}")
         session.rollback()
+        raise
     finally:
         session.close()
 
@@ -301,47 +488,278 @@ def store_event2(payload):
     """
     session = Session()
     try:
-        new_event = Complete(
-            trace_id=payload['trace_id'],
-            task_name=payload['task_name'],
-            task_difficulty=payload.get('task_difficulty'),
-            uuid=payload['uuid'],
-            completed_by=payload.get('completed_by')
-        )
-        session.add(new_event)
+        store_rows(session, 'complete', [complete_row(payload, datetime.now())])
         session.commit()
         logger.info(f"Stored event2 with trace ID: {payload['trace_id']}")
     except Exception as e:
         logger.error(f"Error storing event2: {str(e)}")
         session.rollback()
+        raise
     finally:
         session.close()
 
 def get_event_stats():
-    session = Session()
-    
-    num_tasks = session.query(storage.tasks).count()
-    num_complete = session.query(storage.completed_tasks).count()
-    
-    temp = { 
-            "num_tasks": num_tasks,
-            "num_complete": num_complete
-            }
-    return jsonify(temp), 200
-    session.close()
+    """
+    Return event totals and per-difficulty counts, plus per-hour counts for the
+    last 'hours' hours, read from the counters the write path maintains.
+    """
+    hours = request.args.get('hours', 0, type=int)
+    session, _ = read_session()
+    try:
+        query = session.query(EventCounter).filter(EventCounter.dimension.in_(('total', 'difficulty')))
+        counters = query.all()
+        if hours:
+            first_hour = (datetime.now() - timedelta(hours=hours - 1)).strftime(HOUR_FORMAT)
+            counters += session.query(EventCounter).filter(
+                EventCounter.dimension == 'hour', EventCounter.bucket >= first_hour
+            ).all()
+
+        totals = {}
+        stats = {"by_difficulty": {"create": {}, "complete": {}}}
+        if hours:
+            stats["by_hour"] = {"create": {}, "complete": {}}
+        for counter in counters:
+            if counter.dimension == 'total':
+                totals[counter.event_type] = counter.events
+            else:
+                stats[f"by_{counter.dimension}"].setdefault(counter.event_type, {})[counter.bucket] = counter.events
+
+        stats["num_tasks"] = totals.get('create', 0)
+        stats["num_complete"] = totals.get('complete', 0)
+        return jsonify(stats), 200
+    except Exception as e:
+        logger.error(f"Error retrieving event stats: {str(e)}")
+        return Response("Error retrieving event stats", 500, mimetype='text/plain')
+    finally:
+        session.close()
+
+def id_window(session, table, after_id):
+    """
+    Returns the source and the conditions selecting the rows of a table with an
+    id above after_id, and the highest id among them, which is after_id itself
+    when there are none.
+
+    Rows written within the settle time are left for a later read, since a
+    transaction that took a lower id may not have committed yet. The archives
+    are only read when the cursor is older than every live row.
+    """
+    min_live_id = session.execute(select([func.min(table.c.id)])).scalar()
+    if min_live_id is None or after_id < min_live_id:
+        source = read_source(session, table)
+    else:
+        source = table
+
+    settled = datetime.now() - AGGREGATES_CURSOR_SETTLE
+    last_id = session.execute(
+        select([func.max(source.c.id)]).where(source.c.id > after_id).where(source.c.date_created <= settled)
+    ).scalar()
+    if last_id is None:
+        return source, [source.c.id > after_id, source.c.id <= after_id], after_id
+    return source, [source.c.id > after_id, source.c.id <= last_id], last_id
+
+
+def significant(seconds):
+    """
+    Rounds a duration to two significant digits, the bucket it is counted in.
+    """
+    return '%g' % float(f"{max(seconds, 0):.2g}")
+
+
+def completion_histograms(session, source, conditions):
+    """
+    Returns, per minute of completion, a histogram of the seconds from the
+    creation of each completed task to its completion.
+
+    Durations are bucketed to two significant digits, so histograms from
+    different polls merge by adding counts. The creation time is the one
+    stored with the completion; completions stored without one, because
+    their task row was not found, are left out.
+    """
+    minute = date_bucket(session.get_bind(), source.c.date_created, MINUTE_FORMAT)
+    query = select([minute, source.c.date_created, source.c.task_created_at]).where(
+        source.c.task_created_at.isnot(None)
+    )
+    for condition in conditions:
+        query = query.where(condition)
+
+    histograms = {}
+    for bucket, completed_at, created_at in session.execute(query):
+        histogram = histograms.setdefault(bucket, {})
+        key = significant((completed_at - created_at).total_seconds())
+        histogram[key] = histogram.get(key, 0) + 1
+    return histograms
+
+
+def aggregate_difficulty(session, table, start, end, after_id=None, by_minute=False):
+    """
+    Summarizes the task difficulty of a table within a time window or above an
+    id cursor, archived rows included.
+
+    A single GROUP BY query returns one row per distinct difficulty, from which
+    the count, sum, min, max and histogram are derived, so the response size does
+    not depend on how many rows fell in the window. With a cursor, the id of the
+    last row summarized is returned as last_id, to pass as the next cursor. With
+    by_minute, the count and histogram are also broken down by the minute the
+    rows were created, plus the create-to-complete times for completed tasks.
+    """
+    last_id = None
+    if after_id is not None:
+        source, conditions, last_id = id_window(session, table, after_id)
+        conditions += range_conditions(source.c, start, end)
+    else:
+        source = read_source(session, table, start, end)
+        conditions = range_conditions(source.c, start, end)
+    groups = [source.c.task_difficulty]
+    if by_minute:
+        groups.insert(0, date_bucket(session.get_bind(), source.c.date_created, MINUTE_FORMAT))
+    query = select(groups + [func.count(source.c.id)])
+    for condition in conditions:
+        query = query.where(condition)
+    query = session.execute(query.group_by(*groups))
+
+    histogram = {}
+    minutes = {}
+    count = 0
+    for row in query:
+        difficulty, rows = row[-2:]
+        count += rows
+        if difficulty is not None:
+            histogram[difficulty] = histogram.get(difficulty, 0) + rows
+        if by_minute:
+            minute = minutes.setdefault(row[0], {"count": 0, "difficulty_histogram": {}})
+            minute["count"] += rows
+            if difficulty is not None:
+                minute["difficulty_histogram"][str(difficulty)] = rows
+
+    aggregate = {
+        "count": count,
+        "difficulty_count": sum(histogram.values()),
+        "difficulty_sum": sum(difficulty * rows for difficulty, rows in histogram.items()),
+        "difficulty_min": min(histogram) if histogram else None,
+        "difficulty_max": max(histogram) if histogram else None,
+        "difficulty_histogram": {str(difficulty): rows for difficulty, rows in sorted(histogram.items())}
+    }
+    if last_id is not None:
+        aggregate["last_id"] = last_id
+    if by_minute:
+        if table is Complete.__table__:
+            for bucket, seconds in completion_histograms(session, source, conditions).items():
+                minutes[bucket]["completion_seconds_histogram"] = seconds
+        aggregate["by_minute"] = minutes
+    return aggregate
+
+
+def get_aggregates():
+    """
+    Return counts and task difficulty figures for tasks and completed tasks in
+    a time window, or above the after_task_id/after_completed_id cursors,
+    optionally broken down by minute.
+    """
+    by_minute = request.args.get('by_minute', 'false').lower() == 'true'
+    after_task_id = request.args.get('after_task_id', type=int)
+    after_completed_id = request.args.get('after_completed_id', type=int)
+    # A cursor moves past the ids it returns, so a replica missing recent rows would skip them for good
+    session, _ = read_session(primary=after_task_id is not None or after_completed_id is not None)
+    try:
+        start, end = timestamp_window()
+        aggregates = {
+            "tasks": aggregate_difficulty(session, Create.__table__, start, end, after_task_id, by_minute),
+            "completed_tasks": aggregate_difficulty(session, Complete.__table__, start, end,
+                                                    after_completed_id, by_minute)
+        }
+        logger.info("Aggregates computed: %d tasks, %d completed tasks",
+                    aggregates["tasks"]["count"], aggregates["completed_tasks"]["count"])
+        return jsonify(aggregates), 200
+    except ValueError as e:
+        return Response(str(e), 400, mimetype='text/plain')
+    except Exception as e:
+        logger.error(f"Error computing aggregates: {str(e)}")
+        return Response("Error computing aggregates", 500, mimetype='text/plain')
+    finally:
+        session.close()
+
+
+def archive_old_rows():
+    """
+    Move the rows older than the retention into the monthly archive tables.
+    """
+    cutoff = datetime.now() - timedelta(days=ARCHIVE_RETENTION_DAYS)
+    try:
+        started = monotonic()
+        moved = archive_rows(engine, cutoff)
+        logger.info(f"Archived rows created before {cutoff:%Y-%m-%d %H:%M:%S} in "
+                    f"{monotonic() - started:.1f} s: {moved}")
+    except Exception as e:
+        logger.error(f"Error archiving rows: {str(e)}")
+
+def write_heartbeat():
+    """
+    Write the heartbeat the replica lag is measured with on the primary.
+    """
+    try:
+        replica_router.beat()
+    except Exception as e:
+        logger.error(f"Error writing the replication heartbeat: {str(e)}")
+
+def prune_cache_invalidations():
+    """
+    Delete the query cache invalidations every instance has read.
+    """
+    try:
+        query_cache.prune()
+    except Exception as e:
+        logger.error(f"Error pruning the query cache invalidations: {str(e)}")
+
+def init_scheduler():
+    """
+    Initialize and start the scheduler for the archival job, the replica lag checks and the pruning of
+    the query cache invalidation log.
+    """
+    sched = BackgroundScheduler(daemon=True)
+    sched.add_job(prune_cache_invalidations, 'interval', hours=1)
+    if archive_config['enabled']:
+        sched.add_job(archive_old_rows, 'interval', hours=ARCHIVE_INTERVAL_HOURS, next_run_time=datetime.now())
+    if replica_router.replicas:
+        sched.add_job(write_heartbeat, 'interval', seconds=replica_router.heartbeat_sec,
+                      next_run_time=datetime.now())
+        sched.add_job(replica_router.check, 'interval', seconds=replica_router.check_sec,
+                      next_run_time=datetime.now())
+    sched.start()
+    logger.info("Scheduler initialized and started")
+
+def get_metrics():
+    """
+    Return the Kafka consumer mode, batch throughput and connection pool figures.
+    """
+    metrics = {
+        "consumer_mode": CONSUMER_MODE,
+        "batches": batch_stats.snapshot(),
+        "db_pool": pool_stats.snapshot(engine.pool),
+        "dead_letters": dead_letters.snapshot(),
+        "consumer": consumer_metrics.snapshot(),
+        "query_cache": query_cache.snapshot(),
+        "replication": replica_router.snapshot()
+    }
+    if worker_pool is not None:
+        metrics["workers"] = worker_pool.snapshot()
+    return jsonify(metrics), 200
 
 # Initialize Connexion app
 app = connexion.FlaskApp(__name__, specification_dir='')
 #app.add_api("openapi.yaml", strict_validation=True, validate_responses=True)
-app.add_api("openapi.yaml", base_path="/storage", strict_validation=True, validate_responses=True)
+app.add_api("openapi.yaml", base_path="/storage", strict_validation=True, validate_responses=True,
+            validator_map=RESPONSE_VALIDATOR_MAP)
 
 
 if __name__ == "__main__":
     # Start the Kafka consumer in a separate thread
-    t1 = threading.Thread(target=process_messages)
+    t1 = threading.Thread(target=supervise, args=("Kafka consumer", process_messages,
+                                                  CONSUMER_RESTART_BACKOFF_MS, CONSUMER_MAX_RESTART_BACKOFF_MS))
     t1.setDaemon(True)
     t1.start()
 
+    init_scheduler()
+
     # Start the Flask application
     app.run(host="0.0.0.0", port=8090)
 
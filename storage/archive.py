@@ -0,0 +1,196 @@
+"""
+This module moves old 'tasks' and 'completed_tasks' rows into monthly archive tables and routes range reads to them.
+
+MySQL range partitioning on date_created is not an option for these tables:
+every unique key of a partitioned table must contain the partitioning column,
+and the upserts rely on the unique key on uuid alone. Instead, rows created
+before the retention cutoff are moved, one month at a time, into
+'<table>_archive_YYYYMM' tables that are created on demand (with the
+COMPRESSED row format on MySQL) and recorded in the 'archive_catalog' table
+with the range of date_created they hold.
+
+A range read selects from the live table alone when no archive overlaps the
+range, so recent windows never touch the archives, and otherwise from the
+UNION ALL of the live table and the overlapping archives, each filtered to
+the range. The event counters keep counting archived rows.
+
+Run it from the storage directory to archive once, outside the scheduled job:
+
+    python3 archive.py [--retention-days DAYS]
+"""
+
+import argparse
+import logging
+import threading
+import yaml
+from datetime import datetime, timedelta
+from sqlalchemy import Column, Index, MetaData, Table, and_, create_engine, func, select, union_all
+from catalog import ArchiveCatalog, MONTH_FORMAT
+from writer import EVENT_TABLES
+
+logger = logging.getLogger('basicLogger')
+
+# Archive tables are not part of the models' metadata, so create_all never creates them
+ARCHIVE_METADATA = MetaData()
+archive_lock = threading.Lock()
+
+
+def date_bucket(engine, column, bucket_format):
+    """
+    Returns a SQL expression formatting a timestamp column with a strftime format.
+    """
+    if engine.dialect.name == 'sqlite':
+        return func.strftime(bucket_format, column)
+    # MySQL writes minutes as %i
+    return func.date_format(column, bucket_format.replace('%M', '%i'))
+
+
+def archive_table(table, month):
+    """
+    Returns the archive table of a live table for a month, with the same columns.
+    """
+    name = f"{table.name}_archive_{month.replace('-', '')}"
+    with archive_lock:
+        if name in ARCHIVE_METADATA.tables:
+            return ARCHIVE_METADATA.tables[name]
+        columns = [
+            Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False,
+                   nullable=column.nullable)
+            for column in table.columns
+        ]
+        return Table(name, ARCHIVE_METADATA, *columns, Index(f"ix_{name}_date_created", 'date_created'),
+                     mysql_row_format='COMPRESSED')
+
+
+def range_conditions(columns, start=None, end=None):
+    """
+    Returns the conditions selecting rows created in [start, end); either end may be open.
+    """
+    conditions = []
+    if start is not None:
+        conditions.append(columns.date_created >= start)
+    if end is not None:
+        conditions.append(columns.date_created < end)
+    return conditions
+
+
+def archive_tables(conn, table, start=None, end=None):
+    """
+    Returns the archive tables of a live table holding rows created in [start, end).
+    """
+    catalog = ArchiveCatalog.__table__
+    query = select([catalog.c.month]).where(catalog.c.base_table == table.name)
+    if start is not None:
+        query = query.where(catalog.c.last_created >= start)
+    if end is not None:
+        query = query.where(catalog.c.first_created < end)
+    return [archive_table(table, month) for month, in conn.execute(query.order_by(catalog.c.month))]
+
+
+def read_source(conn, table, start=None, end=None):
+    """
+    Returns the selectable a range read of a live table should use: the table
+    itself, or the UNION ALL of it and the archives overlapping [start, end)
+    under the table's name.
+    """
+    archives = archive_tables(conn, table, start, end)
+    if not archives:
+        return table
+
+    branches = []
+    for source in [table] + archives:
+        branch = select([source.c[name] for name in table.c.keys()])
+        for condition in range_conditions(source.c, start, end):
+            branch = branch.where(condition)
+        branches.append(branch)
+    return union_all(*branches).alias(table.name)
+
+
+def record_archive(conn, table, month, archive, moved, first_created, last_created):
+    """
+    Adds moved rows to the catalog entry of an archive table, creating it if needed.
+    """
+    catalog = ArchiveCatalog.__table__
+    key = and_(catalog.c.base_table == table.name, catalog.c.month == month)
+    entry = conn.execute(select([catalog.c.first_created, catalog.c.last_created]).where(key)).first()
+    if entry is None:
+        conn.execute(catalog.insert().values(
+            base_table=table.name, month=month, archive_table=archive.name, first_created=first_created,
+            last_created=last_created, archived_rows=moved, archived_at=datetime.now()
+        ))
+        return
+    conn.execute(catalog.update().where(key).values(
+        first_created=min(entry.first_created, first_created),
+        last_created=max(entry.last_created, last_created),
+        archived_rows=catalog.c.archived_rows + moved,
+        archived_at=datetime.now()
+    ))
+
+
+def archive_month(engine, table, month, start, end):
+    """
+    Moves the rows of a live table created in [start, end) into the month's
+    archive table in one transaction. Returns the number of rows moved.
+    """
+    archive = archive_table(table, month)
+    # Outside the transaction, since MySQL commits DDL implicitly
+    archive.create(engine, checkfirst=True)
+
+    window = and_(*range_conditions(table.c, start, end))
+    with engine.begin() as conn:
+        first_created, last_created = conn.execute(
+            select([func.min(table.c.date_created), func.max(table.c.date_created)]).where(window)
+        ).first()
+        if first_created is None:
+            return 0
+        columns = table.c.keys()
+        moved = conn.execute(archive.insert().from_select(columns, select([table.c[name] for name in columns])
+                                                          .where(window))).rowcount
+        conn.execute(table.delete().where(window))
+        record_archive(conn, table, month, archive, moved, first_created, last_created)
+    return moved
+
+
+def archive_rows(engine, cutoff):
+    """
+    Moves the rows created before cutoff into their monthly archive tables.
+    Returns the number of rows moved per live table.
+    """
+    moved = {}
+    for table in EVENT_TABLES.values():
+        month = date_bucket(engine, table.c.date_created, MONTH_FORMAT)
+        with engine.connect() as conn:
+            months = sorted(row[0] for row in conn.execute(
+                select([month]).where(table.c.date_created < cutoff).distinct()
+            ))
+
+        moved[table.name] = 0
+        for name in months:
+            start = datetime.strptime(name, MONTH_FORMAT)
+            next_month = (start + timedelta(days=32)).replace(day=1)
+            moved[table.name] += archive_month(engine, table, name, start, min(next_month, cutoff))
+    return moved
+
+
+def main():
+    """
+    Archives the rows older than the retention and prints how many were moved.
+    """
+    # Imported here so the service does not load the migration settings
+    from migrate import DATABASE_URL, app_conf_file
+
+    with open(app_conf_file, 'r') as f:
+        archive_config = yaml.safe_load(f.read())['archive']
+
+    parser = argparse.ArgumentParser(description="Move old storage rows into the monthly archive tables")
+    parser.add_argument("--retention-days", type=int, default=archive_config['retention_days'])
+    args = parser.parse_args()
+
+    cutoff = datetime.now() - timedelta(days=args.retention_days)
+    moved = archive_rows(create_engine(DATABASE_URL), cutoff)
+    for table, rows in moved.items():
+        print(f"{table}: {rows} rows created before {cutoff:%Y-%m-%d %H:%M:%S} archived")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+This script measures the storage read queries with and without the secondary indexes.
+
+It fills a throwaway SQLite database with the ORM schema (indexes included) at
+growing table sizes and times each query twice: once with the indexes disabled
+through SQLite's NOT INDEXED clause, which gives the full table scans of the old
+schema, and once with them. Run it from the storage directory:
+
+    python3 benchmark_indexes.py [size ...]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import timeit
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from base import Base
+from create import Create
+from complete import Complete
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+USERS = 50
+NOW = datetime(2024, 11, 7, 12, 0, 0)
+
+# Query name, table and WHERE clause, matching the reads the services make
+QUERIES = [
+    ("tasks by date_created", "tasks", "date_created >= :start AND date_created < :end"),
+    ("tasks by task_name", "tasks", "task_name = :task_name"),
+    ("tasks by uuid", "tasks", "uuid = :uuid"),
+    ("completed by date_created", "completed_tasks", "date_created >= :start AND date_created < :end"),
+    ("completed by user and date", "completed_tasks", "completed_by = :user AND date_created >= :day_start")
+]
+
+
+def fill(engine, size):
+    """
+    Inserts size rows into each table with creation times spread over thirty days.
+    """
+    tasks, completed = [], []
+    for i in range(size):
+        created = NOW - timedelta(seconds=random.randrange(30 * 24 * 3600))
+        task_uuid = str(uuid.uuid4())
+        tasks.append({
+            'task_name': f"task-{i}", 'due_date': "2024-12-01", 'task_description': "lab",
+            'task_difficulty': i % 10, 'trace_id': str(uuid.uuid4()), 'uuid': task_uuid,
+            'date_created': created
+        })
+        completed.append({
+            'task_name': f"task-{i}", 'task_difficulty': i % 10, 'trace_id': str(uuid.uuid4()),
+            'uuid': task_uuid, 'completed_at': created, 'completion_status': True,
+            'completed_by': f"user-{i % USERS}", 'date_created': created
+        })
+    with engine.begin() as conn:
+        conn.execute(Create.__table__.insert(), tasks)
+        conn.execute(Complete.__table__.insert(), completed)
+    return tasks
+
+
+def time_query(conn, table, where, params, indexed, repeat):
+    """
+    Returns the average time of one query in milliseconds.
+    """
+    hint = "" if indexed else " NOT INDEXED"
+    statement = text(f"SELECT * FROM {table}{hint} WHERE {where}")
+    total = timeit.timeit(lambda: conn.execute(statement, params).fetchall(), number=repeat)
+    return total / repeat * 1000
+
+
+def main():
+    """
+    Prints query times without and with indexes for each table size.
+    """
+    sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"{'rows':>8}  {'query':<28}{'scan ms':>10}{'index ms':>10}{'speedup':>10}")
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.db')}")
+            Base.metadata.create_all(engine)
+            tasks = fill(engine, size)
+            sample = random.choice(tasks)
+            params = {
+                'start': NOW - timedelta(seconds=5), 'end': NOW, 'day_start': NOW - timedelta(days=1),
+                'task_name': sample['task_name'], 'uuid': sample['uuid'], 'user': "user-7"
+            }
+            repeat = max(5, 200000 // size)
+
+            with engine.connect() as conn:
+                for name, table, where in QUERIES:
+                    scan = time_query(conn, table, where, params, False, repeat)
+                    indexed = time_query(conn, table, where, params, True, repeat)
+                    print(f"{size:>8}  {name:<28}{scan:>10.3f}{indexed:>10.3f}{scan / indexed:>9.1f}x")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
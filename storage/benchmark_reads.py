@@ -0,0 +1,158 @@
+"""
+This script compares the ORM and Core read paths of the storage list endpoints.
+
+For each range size it fills a throwaway SQLite database and times reading,
+formatting and JSON-encoding the whole range both ways: the previous path
+(ORM objects, a dict per object, the standard json module as used by jsonify)
+and the current one (selected columns as tuples, records built per chunk,
+records.dumps). Run it from the storage directory:
+
+    python3 benchmark_reads.py [size ...]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from time import perf_counter
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from base import Base
+from create import Create
+from complete import Complete
+from records import (TASK_COLUMNS, COMPLETED_TASK_COLUMNS, task_records, completed_task_records, dumps,
+                     orjson)
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+INSERT_CHUNK = 50000
+START = datetime(2024, 11, 1)
+
+
+def fill(engine, size):
+    """
+    Inserts size rows into each table, one second apart.
+    """
+    for offset in range(0, size, INSERT_CHUNK):
+        tasks, completed = [], []
+        for i in range(offset, min(size, offset + INSERT_CHUNK)):
+            created = START + timedelta(seconds=i, microseconds=i % 1000)
+            task_uuid = str(uuid.uuid4())
+            tasks.append({
+                'task_name': f"task-{i}", 'due_date': "2024-12-01", 'task_description': "lab",
+                'task_difficulty': i % 10, 'trace_id': str(uuid.uuid4()), 'uuid': task_uuid,
+                'date_created': created
+            })
+            completed.append({
+                'task_name': f"task-{i}", 'task_difficulty': i % 10, 'trace_id': str(uuid.uuid4()),
+                'uuid': task_uuid, 'completed_at': created, 'completion_status': True,
+                'completed_by': f"user-{i % 50}", 'date_created': created
+            })
+        with engine.begin() as conn:
+            conn.execute(Create.__table__.insert(), tasks)
+            conn.execute(Complete.__table__.insert(), completed)
+
+
+def orm_tasks(session):
+    """
+    Reads the tasks range the way the endpoint used to.
+    """
+    rows = session.query(Create).filter(Create.date_created >= START).all()
+    data = [
+        {
+            'trace_id': task.trace_id,
+            'task_name': task.task_name,
+            'due_date': task.due_date,
+            'task_description': task.task_description,
+            'task_difficulty': task.task_difficulty,
+            'uuid': task.uuid,
+            'date_created': task.date_created.isoformat()
+        }
+        for task in rows
+    ]
+    return json.dumps(data, sort_keys=True).encode('utf-8')
+
+
+def orm_completed_tasks(session):
+    """
+    Reads the completed tasks range the way the endpoint used to.
+    """
+    rows = session.query(Complete).filter(Complete.date_created >= START).all()
+    data = [
+        {
+            'trace_id': task.trace_id,
+            'task_name': task.task_name,
+            'task_difficulty': task.task_difficulty,
+            'uuid': task.uuid,
+            'completed_by': task.completed_by,
+            'date_created': task.date_created.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        for task in rows
+    ]
+    return json.dumps(data, sort_keys=True).encode('utf-8')
+
+
+def core_tasks(session):
+    """
+    Reads the tasks range through the Core path.
+    """
+    rows = session.execute(select(TASK_COLUMNS).where(Create.date_created >= START)).fetchall()
+    return dumps(task_records(rows))
+
+
+def core_completed_tasks(session):
+    """
+    Reads the completed tasks range through the Core path.
+    """
+    rows = session.execute(select(COMPLETED_TASK_COLUMNS).where(Complete.date_created >= START)).fetchall()
+    return dumps(completed_task_records(rows))
+
+
+PATHS = [
+    ("tasks", orm_tasks, core_tasks),
+    ("completed_tasks", orm_completed_tasks, core_completed_tasks)
+]
+
+
+def best_time(func, session, repeat):
+    """
+    Returns the best of repeat runs of func in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        session.expunge_all()
+        started = perf_counter()
+        func(session)
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """
+    Prints rows/sec of both paths for each range size.
+    """
+    sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"JSON encoder: {'orjson' if orjson is not None else 'json'}")
+    print(f"{'rows':>9}  {'endpoint':<17}{'orm rows/s':>13}{'core rows/s':>13}{'speedup':>9}")
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.db')}")
+            Base.metadata.create_all(engine)
+            fill(engine, size)
+            session = sessionmaker(bind=engine)()
+            repeat = 3 if size <= 100000 else 1
+
+            for name, orm_path, core_path in PATHS:
+                assert json.loads(orm_path(session)) == json.loads(core_path(session))
+                orm = best_time(orm_path, session, repeat)
+                core = best_time(core_path, session, repeat)
+                print(f"{size:>9}  {name:<17}{size / orm:>13,.0f}{size / core:>13,.0f}{orm / core:>8.1f}x")
+            session.close()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+This module defines a SQLAlchemy ORM model for the 'query_cache_invalidations' table.
+"""
+
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from base import Base
+
+
+class CacheInvalidation(Base):
+    """
+    Represents one hour of a table whose rows a committed write changed.
+
+    Every storage instance writes these rows in the transaction of the write
+    and reads the ones logged since its last look before using its query
+    cache, so a write made through one instance invalidates the cached pages
+    of all of them.
+    """
+    __tablename__ = 'query_cache_invalidations'
+    # Keep in step with the migrations in migrate.py
+    __table_args__ = (
+        Index('ix_query_cache_invalidations_logged_at', 'logged_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String(32), nullable=False)
+    hour = Column(DateTime, nullable=False)
+    logged_at = Column(DateTime, nullable=False)
+
+    def to_dict(self):
+        """
+        Converts the CacheInvalidation instance to a dictionary.
+        """
+        return {
+            'id': self.id,
+            'table_name': self.table_name,
+            'hour': self.hour,
+            'logged_at': self.logged_at
+        }
@@ -0,0 +1,42 @@
+"""
+This module defines a SQLAlchemy ORM model for the 'archive_catalog' table.
+"""
+
+from sqlalchemy import Column, String, BigInteger, DateTime
+from base import Base
+
+# Month format of the archive tables, which sorts in time order
+MONTH_FORMAT = "%Y-%m"
+
+
+class ArchiveCatalog(Base):
+    """
+    Represents one monthly archive table of 'tasks' or 'completed_tasks'.
+
+    Each row names the archive table holding the rows of base_table created in
+    month, formatted with MONTH_FORMAT, and the range of date_created it holds,
+    so range reads only select from the archives that overlap them.
+    """
+    __tablename__ = 'archive_catalog'
+
+    base_table = Column(String(32), primary_key=True)
+    month = Column(String(7), primary_key=True)
+    archive_table = Column(String(64), nullable=False)
+    first_created = Column(DateTime, nullable=False)
+    last_created = Column(DateTime, nullable=False)
+    archived_rows = Column(BigInteger, nullable=False, default=0)
+    archived_at = Column(DateTime, nullable=False)
+
+    def to_dict(self):
+        """
+        Converts the ArchiveCatalog instance to a dictionary.
+        """
+        return {
+            'base_table': self.base_table,
+            'month': self.month,
+            'archive_table': self.archive_table,
+            'first_created': self.first_created,
+            'last_created': self.last_created,
+            'archived_rows': self.archived_rows,
+            'archived_at': self.archived_at
+        }
@@ -0,0 +1,150 @@
+"""
+This module tracks how far a Kafka consumer is behind its topic and how fast it processes messages.
+
+Per partition it records the last offset processed and the last offset
+committed, and compares the committed offset with the partition high-water
+mark read from the broker to get the lag. The lag status turns 'warning' or
+'critical' past the thresholds set in the 'consumer' section of app_conf.yml.
+Throughput is messages per second over the last minute, and processing time
+is per message, averaged over the batch when messages are handled together.
+"""
+
+import logging
+import threading
+from collections import deque
+from time import monotonic
+
+logger = logging.getLogger('basicLogger')
+
+# Seconds of history used for the messages/sec figure
+RATE_WINDOW_SEC = 60
+# Number of recent batches used for the processing time figures
+TIMING_WINDOW = 1000
+
+
+class ConsumerMetrics:
+    """
+    Collects offsets, throughput and processing time of one consumer.
+    """
+
+    def __init__(self, lag_warning, lag_critical):
+        """
+        Initializes empty metrics with the lag alert thresholds.
+        """
+        self.lag_warning = lag_warning
+        self.lag_critical = lag_critical
+        self.lock = threading.Lock()
+        self.topic = None
+        self.started = monotonic()
+        self.consumed = {}
+        self.committed = {}
+        self.messages = 0
+        self.arrivals = deque()
+        self.timings = deque(maxlen=TIMING_WINDOW)
+
+    def watch(self, topic):
+        """
+        Sets the pykafka topic whose high-water marks the lag is measured against.
+        """
+        self.topic = topic
+
+    def record(self, msgs, seconds):
+        """
+        Records messages processed together in the given time.
+        """
+        if not msgs:
+            return
+        now = monotonic()
+        with self.lock:
+            for msg in msgs:
+                if msg.offset > self.consumed.get(msg.partition_id, -1):
+                    self.consumed[msg.partition_id] = msg.offset
+            self.messages += len(msgs)
+            self.arrivals.append((now, len(msgs)))
+            while self.arrivals and self.arrivals[0][0] < now - RATE_WINDOW_SEC:
+                self.arrivals.popleft()
+            self.timings.append(seconds * 1000 / len(msgs))
+
+    def record_commit(self, offsets=None):
+        """
+        Records the last committed offset per partition, by default every processed offset.
+        """
+        with self.lock:
+            self.committed.update(self.consumed if offsets is None else offsets)
+
+    def commit(self, consumer):
+        """
+        Commits the consumer's offsets and records them.
+        """
+        consumer.commit_offsets()
+        self.record_commit()
+
+    def high_watermarks(self):
+        """
+        Returns the next offset to be written per partition, or None if the broker cannot be reached.
+        """
+        if self.topic is None:
+            return None
+        try:
+            return {
+                partition_id: response.offset[0]
+                for partition_id, response in self.topic.latest_available_offsets().items()
+            }
+        except Exception as e:
+            logger.warning(f"Could not read the topic high-water marks: {str(e)}")
+            return None
+
+    def lag_status(self, lag):
+        """
+        Returns 'ok', 'warning' or 'critical' for a lag, or 'unknown' without one.
+        """
+        if lag is None:
+            return "unknown"
+        if lag >= self.lag_critical:
+            return "critical"
+        if lag >= self.lag_warning:
+            return "warning"
+        return "ok"
+
+    def snapshot(self):
+        """
+        Returns lag per partition and in total, messages/sec and processing time.
+        """
+        watermarks = self.high_watermarks()
+        now = monotonic()
+        with self.lock:
+            consumed = dict(self.consumed)
+            committed = dict(self.committed)
+            messages = self.messages
+            recent = sum(count for arrived, count in self.arrivals if arrived >= now - RATE_WINDOW_SEC)
+            timings = sorted(self.timings)
+
+        partitions = {}
+        for partition_id in sorted(set(consumed) | set(committed)):
+            partition = {
+                "consumed_offset": consumed.get(partition_id),
+                "committed_offset": committed.get(partition_id),
+                "high_watermark": None,
+                "lag": None
+            }
+            if watermarks is not None and partition_id in watermarks:
+                partition["high_watermark"] = watermarks[partition_id]
+                # Messages written after the last committed one
+                partition["lag"] = max(0, watermarks[partition_id] - committed.get(partition_id, -1) - 1)
+            partitions[str(partition_id)] = partition
+
+        lags = [partition["lag"] for partition in partitions.values()]
+        total_lag = sum(lags) if lags and None not in lags else None
+        return {
+            "lag": total_lag,
+            "lag_status": self.lag_status(total_lag),
+            "lag_thresholds": {"warning": self.lag_warning, "critical": self.lag_critical},
+            "partitions": partitions,
+            "messages": messages,
+            "messages_per_sec": recent / min(RATE_WINDOW_SEC, max(now - self.started, 1)),
+            "processing_ms": {
+                "avg": sum(timings) / len(timings) if timings else 0,
+                "p99": timings[max(0, int(round(0.99 * len(timings))) - 1)] if timings else 0,
+                "max": timings[-1] if timings else 0
+            }
+        }
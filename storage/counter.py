@@ -0,0 +1,36 @@
+"""
+This module defines a SQLAlchemy ORM model for the 'event_counters' table.
+"""
+
+from sqlalchemy import Column, String, BigInteger
+from base import Base
+
+# Hour bucket format, which sorts in time order
+HOUR_FORMAT = "%Y-%m-%dT%H"
+
+
+class EventCounter(Base):
+    """
+    Represents a running count of stored events.
+
+    Each row counts one bucket of one dimension for an event type: 'total' has
+    the single bucket '', 'difficulty' is keyed by task difficulty and 'hour' by
+    the hour the rows were created, formatted with HOUR_FORMAT.
+    """
+    __tablename__ = 'event_counters'
+
+    event_type = Column(String(16), primary_key=True)
+    dimension = Column(String(16), primary_key=True)
+    bucket = Column(String(32), primary_key=True)
+    events = Column(BigInteger, nullable=False, default=0)
+
+    def to_dict(self):
+        """
+        Converts the EventCounter instance to a dictionary.
+        """
+        return {
+            'event_type': self.event_type,
+            'dimension': self.dimension,
+            'bucket': self.bucket,
+            'events': self.events
+        }
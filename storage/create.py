@@ -3,7 +3,7 @@ This module defines a SQLAlchemy ORM model for a 'tasks' table.
 """
 
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index, UniqueConstraint
 from base import Base
 
 class Create(Base):
@@ -11,6 +11,12 @@ class Create(Base):
     Represents a task in the database.
     """
     __tablename__ = "tasks"
+    # Keep in step with the migrations in migrate.py
+    __table_args__ = (
+        UniqueConstraint('uuid', name='uq_tasks_uuid'),
+        Index('ix_tasks_date_created', 'date_created'),
+        Index('ix_tasks_task_name', 'task_name')
+    )
 
     id = Column(Integer, primary_key=True, unique=True)
     task_name = Column(String(250), nullable=False)
@@ -19,7 +25,7 @@ class Create(Base):
     task_difficulty = Column(Integer, nullable=True)
     trace_id = Column(String(36), nullable=True)
     date_created = Column(DateTime, default=datetime.now)
-    uuid = Column(String(36), unique=False, nullable=False)
+    uuid = Column(String(36), nullable=False)
 
     def __init__(self, task_name, due_date, task_description, uuid, task_difficulty=None, trace_id=None):
         """
@@ -0,0 +1,138 @@
+"""
+This module keeps a bad Kafka message from stopping a consumer.
+
+Each message is handled on its own. An error raised by the message itself
+(it cannot be decoded, or a field is missing or of the wrong type) sends it
+to the dead-letter file at once. Any other error, such as the database being
+down, is retried with exponential backoff a bounded number of times and then
+raised, so the consumer stops without committing the message and reads it
+again once supervise() has restarted it.
+Dead letters are appended as JSON lines holding the raw message, its position
+and the error, so they can be inspected and produced again once fixed.
+
+supervise() runs a consumer loop and restarts it with backoff whenever it
+stops or raises.
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from time import monotonic, sleep
+
+logger = logging.getLogger('basicLogger')
+
+# Errors that come from the message itself, so retrying it cannot help
+POISON_ERRORS = (ValueError, KeyError, TypeError, IndexError)
+
+
+class DeadLetterQueue:
+    """
+    Handles messages one at a time and appends the ones that fail to a dead-letter file.
+    """
+
+    def __init__(self, filepath, topic, max_retries, backoff_ms):
+        """
+        Initializes the queue for messages of one topic.
+        """
+        self.filepath = filepath
+        self.topic = topic
+        self.max_retries = max_retries
+        self.backoff_ms = backoff_ms
+        self.lock = threading.Lock()
+        self.counts = {"dead_lettered": 0, "retries": 0}
+        self.last_error = None
+
+    def handle(self, msg, handler):
+        """
+        Calls handler(msg), retrying errors other than POISON_ERRORS with
+        backoff. Returns True if the message was handled and False if it was
+        dead-lettered; raises the error once the retries are used up.
+        """
+        attempt = 1
+        while True:
+            try:
+                handler(msg)
+                return True
+            except POISON_ERRORS as e:
+                self.put(msg, e, attempt)
+                return False
+            except Exception as e:
+                if attempt > self.max_retries:
+                    logger.error(f"Giving up on offset {msg.offset} of partition {msg.partition_id} after "
+                                 f"{attempt} attempts, leaving it uncommitted: {str(e)}")
+                    raise
+                delay = self.backoff_ms * 2 ** (attempt - 1) / 1000
+                logger.warning(f"Attempt {attempt} at offset {msg.offset} of partition {msg.partition_id} "
+                               f"failed, retrying in {delay:.2f} s: {str(e)}")
+                with self.lock:
+                    self.counts["retries"] += 1
+                sleep(delay)
+                attempt += 1
+
+    def put(self, msg, error, attempts=1):
+        """
+        Appends a message to the dead-letter file with the error that stopped it.
+        """
+        record = {
+            "dead_lettered_at": datetime.now().isoformat(timespec='seconds'),
+            "topic": self.topic,
+            "partition_id": msg.partition_id,
+            "offset": msg.offset,
+            "key": msg.partition_key.decode('utf-8', 'replace') if msg.partition_key else None,
+            "error": f"{type(error).__name__}: {error}",
+            "attempts": attempts
+        }
+        try:
+            record["value"] = msg.value.decode('utf-8')
+            record["value_encoding"] = "utf-8"
+        except UnicodeDecodeError:
+            # Binary envelopes are kept as base64
+            record["value"] = base64.b64encode(msg.value).decode('ascii')
+            record["value_encoding"] = "base64"
+
+        logger.error(f"Dead-lettering message at offset {msg.offset} of partition {msg.partition_id} "
+                     f"after {attempts} attempt(s): {record['error']}")
+        with self.lock:
+            self.counts["dead_lettered"] += 1
+            self.last_error = record["error"]
+            try:
+                directory = os.path.dirname(self.filepath)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.filepath, 'a') as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                # The message must not be lost silently, so it goes to the log instead
+                logger.error(f"Could not write dead letter to {self.filepath}: {str(e)}; message: {record}")
+
+    def snapshot(self):
+        """
+        Returns the dead-letter and retry counts and the last dead-letter error.
+        """
+        with self.lock:
+            return {**self.counts, "last_error": self.last_error}
+
+
+def supervise(name, target, backoff_ms, max_backoff_ms):
+    """
+    Runs target() forever, restarting it after a delay whenever it returns or
+    raises. The delay doubles on each restart up to max_backoff_ms and starts
+    over once target has run for longer than that.
+    """
+    delay = backoff_ms
+    while True:
+        started = monotonic()
+        try:
+            target()
+            logger.error(f"{name} stopped")
+        except Exception as e:
+            logger.error(f"{name} failed: {str(e)}")
+
+        if monotonic() - started > max_backoff_ms / 1000:
+            delay = backoff_ms
+        logger.info(f"Restarting {name} in {delay / 1000:.1f} s")
+        sleep(delay / 1000)
+        delay = min(delay * 2, max_backoff_ms)
@@ -0,0 +1,31 @@
+"""
+This module defines a SQLAlchemy ORM model for the 'replication_heartbeat' table.
+"""
+
+from sqlalchemy import Column, Integer, DateTime
+from base import Base
+
+# The single row of the table
+HEARTBEAT_ID = 1
+
+
+class ReplicationHeartbeat(Base):
+    """
+    Represents the last time the storage service wrote to the primary database.
+
+    The primary's row is rewritten every few seconds; the copy of it on a
+    replica shows how far that replica's data is behind the primary.
+    """
+    __tablename__ = 'replication_heartbeat'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    beat_at = Column(DateTime, nullable=False)
+
+    def to_dict(self):
+        """
+        Converts the ReplicationHeartbeat instance to a dictionary.
+        """
+        return {
+            'id': self.id,
+            'beat_at': self.beat_at
+        }
@@ -0,0 +1,487 @@
+"""
+This script manages the MySQL schema of the storage service with versioned migrations.
+
+Each migration has a version number, an upgrade and a downgrade step. The
+versions applied so far are recorded in the 'schema_version' table, so running
+'upgrade' again only applies what is missing. MySQL commits DDL implicitly, so
+a version is recorded right after its own statements succeed.
+
+    python3 migrate.py create-user --root-password <password>
+    python3 migrate.py status
+    python3 migrate.py upgrade [--to VERSION]
+    python3 migrate.py downgrade --to VERSION
+    python3 migrate.py drop
+
+After upgrading to version 4, run 'python3 reconcile_counters.py' once to
+fill the event counters from the rows already stored. Version 5 adds the
+catalog of the monthly archive tables that archive.py creates; downgrading
+below it drops the archive tables with their rows. Version 6 adds the heartbeat
+row the service rewrites to measure the lag of its read replicas. Version 7
+adds the log through which the service instances share the invalidations of
+their query caches. Version 8 stores the creation time of the task with each
+completion, in completed_tasks and its archive tables, filled for the
+completions whose task is still in the tasks table.
+
+The connection settings come from the 'datastore' section of app_conf.yml.
+When its 'url' points at a SQLite file, as for trying the read replicas
+locally, 'upgrade' creates the tables of the models as of the latest version
+instead, with the heartbeat row; 'status' lists them and 'drop' drops them.
+Downgrades are MySQL only.
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+import yaml
+from sqlalchemy import create_engine, inspect, select, text
+from db import database_url
+from base import Base
+# The models register their tables in Base.metadata for the SQLite schema
+from create import Create
+from complete import Complete
+from counter import EventCounter
+from catalog import ArchiveCatalog
+from heartbeat import ReplicationHeartbeat, HEARTBEAT_ID
+from cache_invalidation import CacheInvalidation
+
+if "TARGET_ENV" in os.environ and os.environ["TARGET_ENV"] == "test":
+    app_conf_file = "/config/app_conf.yml"
+else:
+    app_conf_file = "app_conf.yml"
+
+with open(app_conf_file, 'r') as f:
+    db_config = yaml.safe_load(f.read())['datastore']
+
+SERVER_URL = f"mysql+pymysql://{{user}}:{{password}}@{db_config.get('hostname')}:{db_config.get('port')}"
+DATABASE_URL = database_url(db_config)
+
+
+def index_exists(conn, table, index):
+    """
+    Returns whether the named index exists on a table of the current database.
+    """
+    return conn.execute(text('''
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index
+    '''), table=table, index=index).scalar() > 0
+
+
+def column_exists(conn, table, column):
+    """
+    Returns whether a table of the current database has the named column.
+    """
+    return conn.execute(text('''
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = :table AND column_name = :column
+    '''), table=table, column=column).scalar() > 0
+
+
+def completed_tables(conn):
+    """
+    Returns 'completed_tasks' and the names of its archive tables.
+    """
+    archives = conn.execute(text(
+        "SELECT archive_table FROM archive_catalog WHERE base_table = 'completed_tasks'"
+    )).fetchall()
+    return ['completed_tasks'] + [archive_table for archive_table, in archives]
+
+
+def create_tables(conn):
+    """
+    Creates the 'tasks' and 'completed_tasks' tables.
+    """
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INT NOT NULL AUTO_INCREMENT,
+            task_name VARCHAR(250) NOT NULL,
+            due_date VARCHAR(250) NOT NULL,
+            task_description VARCHAR(100) NOT NULL,
+            trace_id VARCHAR(36),
+            task_difficulty INT,
+            uuid VARCHAR(36),
+            date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id)
+        )
+    '''))
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS completed_tasks (
+            id INT NOT NULL AUTO_INCREMENT,
+            task_name VARCHAR(250) NOT NULL,
+            task_difficulty INT,
+            trace_id VARCHAR(36),
+            uuid VARCHAR(36) NOT NULL,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completion_status BOOLEAN NOT NULL DEFAULT 0,
+            completed_by VARCHAR(250) NOT NULL,
+            date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id)
+        )
+    '''))
+
+
+def drop_tables(conn):
+    """
+    Drops the 'tasks' and 'completed_tasks' tables.
+    """
+    conn.execute(text('DROP TABLE IF EXISTS tasks, completed_tasks'))
+
+
+def add_unique_uuids(conn):
+    """
+    Adds the unique uuid keys the storage upserts rely on, keeping the oldest row per uuid.
+    """
+    for table in ('tasks', 'completed_tasks'):
+        if index_exists(conn, table, f'uq_{table}_uuid'):
+            continue
+        conn.execute(text(f'''
+            DELETE newer FROM {table} newer
+            JOIN {table} older ON newer.uuid = older.uuid AND newer.id > older.id
+        '''))
+        conn.execute(text(f'ALTER TABLE {table} ADD UNIQUE KEY uq_{table}_uuid (uuid)'))
+
+
+def drop_unique_uuids(conn):
+    """
+    Removes the unique uuid keys.
+    """
+    for table in ('tasks', 'completed_tasks'):
+        if index_exists(conn, table, f'uq_{table}_uuid'):
+            conn.execute(text(f'ALTER TABLE {table} DROP INDEX uq_{table}_uuid'))
+
+
+# Secondary indexes for the timestamp range reads, the task name lookup of
+# /complete and the per-user completion queries. The uuid lookups use the
+# unique keys above.
+SECONDARY_INDEXES = {
+    'tasks': {
+        'ix_tasks_date_created': '(date_created)',
+        'ix_tasks_task_name': '(task_name)'
+    },
+    'completed_tasks': {
+        'ix_completed_tasks_date_created': '(date_created)',
+        'ix_completed_tasks_completed_by_date_created': '(completed_by, date_created)'
+    }
+}
+
+
+def add_secondary_indexes(conn):
+    """
+    Creates the secondary indexes that are missing.
+    """
+    for table, indexes in SECONDARY_INDEXES.items():
+        for index, columns in indexes.items():
+            if not index_exists(conn, table, index):
+                conn.execute(text(f'CREATE INDEX {index} ON {table} {columns}'))
+
+
+def drop_secondary_indexes(conn):
+    """
+    Drops the secondary indexes that exist.
+    """
+    for table, indexes in SECONDARY_INDEXES.items():
+        for index in indexes:
+            if index_exists(conn, table, index):
+                conn.execute(text(f'DROP INDEX {index} ON {table}'))
+
+
+def create_event_counters(conn):
+    """
+    Creates the 'event_counters' table maintained by the storage write path.
+    """
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS event_counters (
+            event_type VARCHAR(16) NOT NULL,
+            dimension VARCHAR(16) NOT NULL,
+            bucket VARCHAR(32) NOT NULL,
+            events BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (event_type, dimension, bucket)
+        )
+    '''))
+
+
+def drop_event_counters(conn):
+    """
+    Drops the 'event_counters' table.
+    """
+    conn.execute(text('DROP TABLE IF EXISTS event_counters'))
+
+
+def create_archive_catalog(conn):
+    """
+    Creates the 'archive_catalog' table listing the monthly archive tables.
+    """
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS archive_catalog (
+            base_table VARCHAR(32) NOT NULL,
+            month VARCHAR(7) NOT NULL,
+            archive_table VARCHAR(64) NOT NULL,
+            first_created DATETIME NOT NULL,
+            last_created DATETIME NOT NULL,
+            archived_rows BIGINT NOT NULL DEFAULT 0,
+            archived_at DATETIME NOT NULL,
+            PRIMARY KEY (base_table, month)
+        )
+    '''))
+
+
+def drop_archive_catalog(conn):
+    """
+    Drops the archive tables listed in the catalog and the catalog itself.
+    """
+    if conn.execute(text('''
+        SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = 'archive_catalog'
+    ''')).scalar():
+        for archive_table, in conn.execute(text('SELECT archive_table FROM archive_catalog')):
+            conn.execute(text(f'DROP TABLE IF EXISTS {archive_table}'))
+    conn.execute(text('DROP TABLE IF EXISTS archive_catalog'))
+
+
+def create_replication_heartbeat(conn):
+    """
+    Creates the 'replication_heartbeat' table with its single row.
+    """
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS replication_heartbeat (
+            id INT NOT NULL,
+            beat_at DATETIME(6) NOT NULL,
+            PRIMARY KEY (id)
+        )
+    '''))
+    conn.execute(text('INSERT IGNORE INTO replication_heartbeat (id, beat_at) VALUES (1, NOW(6))'))
+
+
+def drop_replication_heartbeat(conn):
+    """
+    Drops the 'replication_heartbeat' table.
+    """
+    conn.execute(text('DROP TABLE IF EXISTS replication_heartbeat'))
+
+
+def create_cache_invalidations(conn):
+    """
+    Creates the 'query_cache_invalidations' table the storage instances share cache invalidations through.
+    """
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS query_cache_invalidations (
+            id INT NOT NULL AUTO_INCREMENT,
+            table_name VARCHAR(32) NOT NULL,
+            hour DATETIME NOT NULL,
+            logged_at DATETIME NOT NULL,
+            PRIMARY KEY (id),
+            INDEX ix_query_cache_invalidations_logged_at (logged_at)
+        )
+    '''))
+
+
+def drop_cache_invalidations(conn):
+    """
+    Drops the 'query_cache_invalidations' table.
+    """
+    conn.execute(text('DROP TABLE IF EXISTS query_cache_invalidations'))
+
+
+def add_task_created_at(conn):
+    """
+    Adds the task creation time to the completed tasks and fills it from the live tasks.
+    """
+    for table in completed_tables(conn):
+        if not column_exists(conn, table, 'task_created_at'):
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN task_created_at DATETIME NULL'))
+    conn.execute(text('''
+        UPDATE completed_tasks JOIN tasks ON tasks.uuid = completed_tasks.uuid
+        SET completed_tasks.task_created_at = tasks.date_created
+        WHERE completed_tasks.task_created_at IS NULL
+    '''))
+
+
+def drop_task_created_at(conn):
+    """
+    Removes the task creation time from the completed tasks.
+    """
+    for table in completed_tables(conn):
+        if column_exists(conn, table, 'task_created_at'):
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN task_created_at'))
+
+
+# (version, description, upgrade, downgrade), in the order they are applied
+MIGRATIONS = [
+    (1, "create tasks and completed_tasks", create_tables, drop_tables),
+    (2, "unique uuid keys", add_unique_uuids, drop_unique_uuids),
+    (3, "secondary indexes", add_secondary_indexes, drop_secondary_indexes),
+    (4, "event counters", create_event_counters, drop_event_counters),
+    (5, "archive catalog", create_archive_catalog, drop_archive_catalog),
+    (6, "replication heartbeat", create_replication_heartbeat, drop_replication_heartbeat),
+    (7, "query cache invalidations", create_cache_invalidations, drop_cache_invalidations),
+    (8, "task creation time of completions", add_task_created_at, drop_task_created_at)
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def applied_versions(conn):
+    """
+    Returns the set of applied migration versions, creating the version table if needed.
+    """
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT NOT NULL,
+            description VARCHAR(250) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (version)
+        )
+    '''))
+    return {row[0] for row in conn.execute(text('SELECT version FROM schema_version'))}
+
+
+def upgrade(engine, target):
+    """
+    Applies the missing migrations up to and including the target version.
+    """
+    with engine.connect() as conn:
+        applied = applied_versions(conn)
+        for version, description, up, _ in MIGRATIONS:
+            if version > target or version in applied:
+                continue
+            print(f"Applying {version}: {description}")
+            up(conn)
+            conn.execute(text('INSERT INTO schema_version (version, description) VALUES (:version, :description)'),
+                         version=version, description=description)
+
+
+def downgrade(engine, target):
+    """
+    Reverts the applied migrations above the target version, newest first.
+    """
+    with engine.connect() as conn:
+        applied = applied_versions(conn)
+        for version, description, _, down in reversed(MIGRATIONS):
+            if version <= target or version not in applied:
+                continue
+            print(f"Reverting {version}: {description}")
+            down(conn)
+            conn.execute(text('DELETE FROM schema_version WHERE version = :version'), version=version)
+
+
+def status(engine):
+    """
+    Prints each migration and whether it has been applied.
+    """
+    with engine.connect() as conn:
+        applied = applied_versions(conn)
+    for version, description, _, _ in MIGRATIONS:
+        state = "applied" if version in applied else "pending"
+        print(f"{version:>4}  {state:<8} {description}")
+
+
+def drop(engine):
+    """
+    Drops the storage tables and the version table.
+    """
+    with engine.connect() as conn:
+        drop_archive_catalog(conn)
+        conn.execute(text('DROP TABLE IF EXISTS tasks, completed_tasks, event_counters, replication_heartbeat, '
+                          'query_cache_invalidations, schema_version'))
+    print("Tables dropped.")
+
+
+def create_sqlite_schema(engine):
+    """
+    Creates the missing tables of the models and the heartbeat row in a SQLite database.
+    """
+    Base.metadata.create_all(engine)
+    table = ReplicationHeartbeat.__table__
+    with engine.begin() as conn:
+        if conn.execute(select([table.c.id]).where(table.c.id == HEARTBEAT_ID)).first() is None:
+            conn.execute(table.insert().values(id=HEARTBEAT_ID, beat_at=datetime.now()))
+    print("Tables created.")
+
+
+def sqlite_status(engine):
+    """
+    Prints each table of the models and whether it exists in a SQLite database.
+    """
+    existing = set(inspect(engine).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        state = "present" if table.name in existing else "missing"
+        print(f"{state:<8} {table.name}")
+
+
+def drop_sqlite_schema(engine):
+    """
+    Drops the archive tables listed in the catalog and the tables of the models from a SQLite database.
+    """
+    catalog = ArchiveCatalog.__table__
+    if catalog.name in inspect(engine).get_table_names():
+        with engine.begin() as conn:
+            for archive_table, in conn.execute(select([catalog.c.archive_table])).fetchall():
+                conn.execute(text(f'DROP TABLE IF EXISTS {archive_table}'))
+    Base.metadata.drop_all(engine)
+    print("Tables dropped.")
+
+
+def create_user(root_user, root_password):
+    """
+    Creates the storage database and the datastore user with full privileges on it.
+    """
+    engine = create_engine(SERVER_URL.format(user=root_user, password=root_password))
+    with engine.connect() as conn:
+        conn.execute(text(f"CREATE DATABASE IF NOT EXISTS {db_config['db']}"))
+        conn.execute(text(f"CREATE USER IF NOT EXISTS '{db_config['user']}'@'%' IDENTIFIED BY :password"),
+                     password=db_config['password'])
+        conn.execute(text(f"GRANT ALL PRIVILEGES ON {db_config['db']}.* TO '{db_config['user']}'@'%'"))
+        conn.execute(text("FLUSH PRIVILEGES"))
+    print(f"User '{db_config['user']}' created with full privileges on '{db_config['db']}' database.")
+
+
+def main():
+    """
+    Parses the command line and runs the requested command.
+    """
+    parser = argparse.ArgumentParser(description="Storage schema migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    user_parser = commands.add_parser("create-user", help="create the database and the datastore user")
+    user_parser.add_argument("--root-user", default="root")
+    user_parser.add_argument("--root-password", required=True)
+
+    commands.add_parser("status", help="list migrations and whether they are applied")
+
+    upgrade_parser = commands.add_parser("upgrade", help="apply pending migrations")
+    upgrade_parser.add_argument("--to", type=int, default=LATEST_VERSION)
+
+    downgrade_parser = commands.add_parser("downgrade", help="revert migrations above a version")
+    downgrade_parser.add_argument("--to", type=int, required=True)
+
+    commands.add_parser("drop", help="drop all storage tables")
+
+    args = parser.parse_args()
+    engine = create_engine(DATABASE_URL)
+    if engine.dialect.name == 'sqlite':
+        if args.command == "create-user":
+            print("SQLite has no users; the database file is created by 'upgrade'.")
+        elif args.command == "status":
+            sqlite_status(engine)
+        elif args.command == "upgrade":
+            create_sqlite_schema(engine)
+        elif args.command == "downgrade":
+            print("Downgrades are not supported on SQLite; use 'drop' and 'upgrade'.")
+            return 1
+        elif args.command == "drop":
+            drop_sqlite_schema(engine)
+        return
+
+    if args.command == "create-user":
+        create_user(args.root_user, args.root_password)
+    elif args.command == "status":
+        status(engine)
+    elif args.command == "upgrade":
+        upgrade(engine, args.to)
+    elif args.command == "downgrade":
+        downgrade(engine, args.to)
+    elif args.command == "drop":
+        drop(engine)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
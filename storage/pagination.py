@@ -0,0 +1,140 @@
+"""
+This module provides keyset pagination and NDJSON streaming for the storage list endpoints.
+
+Rows are ordered by (date_created, id). A cursor is the opaque, URL-safe
+encoding of the last row's key, and the next page starts strictly after it,
+so pages stay stable while new rows are written and the date_created index
+serves every page.
+"""
+
+import base64
+import json
+import logging
+from datetime import datetime
+from connexion.exceptions import NonConformingResponseBody
+from connexion.validators import VALIDATOR_MAP, JSONResponseBodyValidator
+from connexion.datastructures import MediaTypeDict
+from sqlalchemy import and_, or_
+from records import dumps
+
+logger = logging.getLogger('basicLogger')
+
+# Rows fetched per round trip when streaming
+STREAM_CHUNK_SIZE = 1000
+
+
+class InvalidCursorError(ValueError):
+    """
+    Raised when a cursor was not produced by encode_cursor.
+    """
+
+
+def encode_cursor(row):
+    """
+    Encodes the (date_created, id) key of a row as an opaque cursor.
+    """
+    key = json.dumps([row.date_created.isoformat(), row.id])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor back into its (date_created, id) key.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_created, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(date_created), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_select(statement, model, cursor=None):
+    """
+    Orders a select by (date_created, id), resuming after the cursor if one is given.
+    """
+    if cursor:
+        date_created, row_id = decode_cursor(cursor)
+        statement = statement.where(or_(
+            model.date_created > date_created,
+            and_(model.date_created == date_created, model.id > row_id)
+        ))
+    return statement.order_by(model.date_created, model.id)
+
+
+def fetch_page(session, statement, limit=None):
+    """
+    Returns the rows of a keyset select and the cursor of the next page, if any.
+
+    One row past the limit is fetched to tell whether another page exists.
+    """
+    if limit:
+        statement = statement.limit(limit + 1)
+    rows = session.execute(statement).fetchall()
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def stream_ndjson(session, statement, to_records):
+    """
+    Yields the rows as NDJSON, one chunk of lines per STREAM_CHUNK_SIZE rows read
+    through a server-side cursor, and closes the session once the rows are exhausted.
+    """
+    try:
+        result = session.execute(statement.execution_options(stream_results=True))
+        while True:
+            rows = result.fetchmany(STREAM_CHUNK_SIZE)
+            if not rows:
+                break
+            yield b"".join(dumps(record) + b"\n" for record in to_records(rows))
+    finally:
+        session.close()
+
+
+class NDJSONResponseBodyValidator(JSONResponseBodyValidator):
+    """
+    Validates an NDJSON response line by line as it is sent.
+
+    The stock JSON validator holds the whole body until it can parse it, which
+    would undo the streaming. The status has already been sent by the time a
+    line is checked, so a non-conforming line is logged rather than turned into
+    an error response.
+    """
+
+    def wrap_send(self, send):
+        """
+        Wraps the send channel, validating each complete line and passing every message on.
+        """
+        partial = b""
+
+        async def send_(message):
+            nonlocal partial
+            if message["type"] == "http.response.body":
+                lines = (partial + message.get("body", b"")).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    if line:
+                        self._validate_line(line)
+            await send(message)
+
+        return send_
+
+    def _validate_line(self, line):
+        """
+        Validates one NDJSON line against the schema of a single row.
+        """
+        try:
+            self._validate(json.loads(line.decode(self._encoding)))
+        except (ValueError, NonConformingResponseBody) as e:
+            logger.warning(f"Streamed row does not conform to specification: {str(e)}")
+
+
+# Response validators with NDJSON checked line by line
+RESPONSE_VALIDATOR_MAP = {
+    "response": MediaTypeDict({
+        **VALIDATOR_MAP["response"],
+        "application/x-ndjson": NDJSONResponseBodyValidator
+    })
+}
@@ -0,0 +1,338 @@
+"""
+This module caches the responses of the storage list endpoints for time windows that can no longer change.
+
+Rows are stamped with the time they are written, so once a window has ended
+(plus a settle time for writes still in flight) no new row falls into it and
+its pages can be served from memory. The only writes that change such a
+window are replayed events updating rows written earlier and completions
+removing a task, and those invalidate just the cached windows that contain
+the hours of the rows they touched, after their transaction commits.
+
+Pages read from a read replica may be up to the replica's staleness behind
+the primary, so for them the window must have ended that much longer ago, and
+a page is not cached if its table was invalidated within that time before the
+read, as the replica may not have had the write yet.
+
+The service runs as several instances, each with its own cache, so a write
+also logs the hours it touched in the 'query_cache_invalidations' table, in
+its own transaction. An instance reads the rows logged since its last look,
+from the primary, at most every sync_interval_sec, on a lookup or a put, and
+applies them; if the log cannot be read the cache is bypassed until it can.
+Another instance's write thus reaches the cache up to sync_interval_sec after
+it commits, so that interval is added to the settle and staleness margins.
+The log is read with an overlap,
+for rows committed out of id order and for clock skew between instances, and
+rows older than log_retention_sec are pruned; an instance that has not looked
+for that long empties its cache.
+
+Entries are kept in least recently used order, bounded by count and by total
+body size, and optionally expire after a TTL.
+"""
+
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from time import monotonic
+from sqlalchemy import event, select
+from cache_invalidation import CacheInvalidation
+
+logger = logging.getLogger('basicLogger')
+
+# Session.info key of the rows a transaction touched, by table name
+TOUCHED_KEY = 'query_cache_touched'
+# How far before its last look an instance reads the invalidation log again
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class CacheEntry:
+    """
+    A cached response and the window of one table it covers.
+    """
+
+    def __init__(self, table, start, end, body, next_cursor, expires_at):
+        """
+        Initializes the entry.
+        """
+        self.table = table
+        self.start = start
+        self.end = end
+        self.body = body
+        self.next_cursor = next_cursor
+        self.expires_at = expires_at
+
+
+class QueryCache:
+    """
+    LRU cache of list responses keyed by (table, start, end, cursor, limit).
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty, unbounded cache.
+        """
+        self.configure()
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.log_engine = None
+        self.synced_at = None
+        self.synced_ids = {}
+        self.sync_checked = float('-inf')
+        self.sync_ok = True
+        self.entries = OrderedDict()
+        self.size = 0
+        self.invalidated_at = defaultdict(lambda: float('-inf'))
+        self.cleared_at = float('-inf')
+        self.counts = {"hits": 0, "misses": 0, "uncacheable": 0, "evictions": 0, "expirations": 0,
+                       "invalidations": 0}
+
+    def configure(self, max_entries=None, max_bytes=None, ttl_sec=None, settle_sec=0, log_retention_sec=86400,
+                  sync_interval_sec=1):
+        """
+        Sets the bounds of the cache; a bound of None or 0 is no bound.
+        """
+        self.sync_interval = sync_interval_sec
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.settle = timedelta(seconds=settle_sec)
+        self.log_retention = timedelta(seconds=log_retention_sec)
+
+    def share(self, engine):
+        """
+        Shares invalidations with the other instances through the log in the engine's database.
+        """
+        self.log_engine = engine
+
+    @property
+    def sync_margin_sec(self):
+        """
+        Returns how long after it commits another instance's write can take to invalidate this cache.
+        """
+        return self.sync_interval if self.log_engine is not None else 0
+
+    @staticmethod
+    def key(table, start, end, cursor, limit):
+        """
+        Returns the cache key of a request, with timestamps as the naive wall
+        clock times the database compares them as.
+        """
+        return (table, start.replace(tzinfo=None).isoformat() if start else None,
+                end.replace(tzinfo=None).isoformat(), cursor, limit)
+
+    def cacheable(self, end, staleness_sec=0):
+        """
+        Returns whether a window ending at end can no longer change, in data
+        up to staleness_sec behind the primary.
+        """
+        margin = timedelta(seconds=staleness_sec + self.sync_margin_sec)
+        return end is not None and end.replace(tzinfo=None) + self.settle + margin <= datetime.now()
+
+    def read_started(self):
+        """
+        Returns the time a read starts, to pass to put.
+        """
+        return monotonic()
+
+    def sync(self):
+        """
+        Applies the invalidations logged by any instance since the last look,
+        unless it was less than sync_interval_sec ago.
+
+        Returns False if the log could not be read at the last look, when the
+        cache must not be used.
+        """
+        if self.log_engine is None:
+            return True
+        if monotonic() - self.sync_checked < self.sync_interval:
+            return self.sync_ok
+        log = CacheInvalidation.__table__
+        with self.sync_lock:
+            if monotonic() - self.sync_checked < self.sync_interval:
+                # Another thread looked while this one waited
+                return self.sync_ok
+            now = datetime.now()
+            since = (self.synced_at or now) - SYNC_OVERLAP
+            try:
+                with self.log_engine.connect() as conn:
+                    rows = conn.execute(select([log.c.id, log.c.table_name, log.c.hour, log.c.logged_at])
+                                        .where(log.c.logged_at >= since)).fetchall()
+            except Exception as e:
+                logger.error(f"Could not read the query cache invalidations: {str(e)}")
+                self.sync_ok = False
+                self.sync_checked = monotonic()
+                return False
+
+            if self.synced_at is not None and now - self.synced_at > self.log_retention - SYNC_OVERLAP:
+                # The rows logged since the last look may have been pruned
+                self.clear()
+            hours = defaultdict(set)
+            for row in rows:
+                if row.id not in self.synced_ids:
+                    self.synced_ids[row.id] = row.logged_at
+                    hours[row.table_name].add(row.hour)
+            for table, table_hours in hours.items():
+                self.invalidate(table, table_hours)
+            # Rows logged before the next look's overlap are not read again
+            self.synced_ids = {id: logged_at for id, logged_at in self.synced_ids.items()
+                               if logged_at >= now - SYNC_OVERLAP}
+            self.synced_at = now
+            self.sync_ok = True
+            self.sync_checked = monotonic()
+        return True
+
+    def prune(self):
+        """
+        Deletes the invalidations logged longer ago than the log retention.
+        """
+        if self.log_engine is None:
+            return
+        log = CacheInvalidation.__table__
+        with self.log_engine.begin() as conn:
+            deleted = conn.execute(log.delete().where(log.c.logged_at < datetime.now() - self.log_retention))
+        logger.info(f"Pruned {deleted.rowcount} query cache invalidations")
+
+    def get(self, key):
+        """
+        Returns the cached entry of a key, or None.
+        """
+        if not self.sync():
+            with self.lock:
+                self.counts["misses"] += 1
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= monotonic():
+                self._remove(key)
+                self.counts["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.counts["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return entry
+
+    def count_uncacheable(self):
+        """
+        Counts a request for a window that is still open.
+        """
+        with self.lock:
+            self.counts["uncacheable"] += 1
+
+    def put(self, key, start, end, body, next_cursor, read_started, staleness_sec=0):
+        """
+        Caches a response whose read started at read_started, from data up to
+        staleness_sec behind the primary.
+
+        A response is dropped if the table was invalidated after its data was
+        current, since it may hold the rows as they were before the write.
+        """
+        if not self.sync():
+            return
+        table = key[0]
+        expires_at = monotonic() + self.ttl_sec if self.ttl_sec else None
+        with self.lock:
+            margin = staleness_sec + self.sync_margin_sec
+            if max(self.invalidated_at[table], self.cleared_at) >= read_started - margin:
+                return
+            if self.max_bytes and len(body) > self.max_bytes:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CacheEntry(table, start.replace(tzinfo=None) if start else None,
+                                           end.replace(tzinfo=None), body, next_cursor, expires_at)
+            self.size += len(body)
+            while ((self.max_entries and len(self.entries) > self.max_entries)
+                   or (self.max_bytes and self.size > self.max_bytes)):
+                self._remove(next(iter(self.entries)))
+                self.counts["evictions"] += 1
+
+    def invalidate(self, table, times):
+        """
+        Drops the cached windows of a table that contain the hour of any of the given row times.
+        """
+        hours = {time.replace(minute=0, second=0, microsecond=0) for time in times if time is not None}
+        if not hours:
+            return
+        with self.lock:
+            self.invalidated_at[table] = monotonic()
+            stale = [
+                key for key, entry in self.entries.items()
+                if entry.table == table and any(
+                    (entry.start is None or hour + timedelta(hours=1) > entry.start) and hour < entry.end
+                    for hour in hours
+                )
+            ]
+            for key in stale:
+                self._remove(key)
+            self.counts["invalidations"] += len(stale)
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        with self.lock:
+            self.cleared_at = monotonic()
+            self.counts["invalidations"] += len(self.entries)
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        """
+        Removes an entry; the caller holds the lock.
+        """
+        entry = self.entries.pop(key)
+        self.size -= len(entry.body)
+
+    def snapshot(self):
+        """
+        Returns the entry count, size and hit/miss figures.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            stats["entries"] = len(self.entries)
+            stats["bytes"] = self.size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0
+        return stats
+
+
+query_cache = QueryCache()
+
+
+def touch(session, table, times):
+    """
+    Records the date_created of rows a session's transaction changed, so the
+    windows holding them are invalidated once it commits.
+    """
+    session.info.setdefault(TOUCHED_KEY, defaultdict(list))[table].extend(times)
+
+
+def invalidate_on_commit(session_factory):
+    """
+    Logs the hours of the rows touched by each transaction of the factory's
+    sessions in it, when invalidations are shared, and invalidates the cache
+    after it commits.
+    """
+    @event.listens_for(session_factory, 'before_commit')
+    def before_commit(session):
+        if query_cache.log_engine is None:
+            return
+        now = datetime.now()
+        rows = [
+            {"table_name": table, "hour": hour, "logged_at": now}
+            for table, times in session.info.get(TOUCHED_KEY, {}).items()
+            for hour in {time.replace(minute=0, second=0, microsecond=0) for time in times if time is not None}
+        ]
+        if rows:
+            session.execute(CacheInvalidation.__table__.insert(), rows)
+
+    @event.listens_for(session_factory, 'after_commit')
+    def after_commit(session):
+        for table, times in session.info.pop(TOUCHED_KEY, {}).items():
+            query_cache.invalidate(table, times)
+
+    @event.listens_for(session_factory, 'after_soft_rollback')
+    def after_soft_rollback(session, previous_transaction):
+        session.info.pop(TOUCHED_KEY, None)
@@ -0,0 +1,74 @@
+"""
+This script rebuilds the 'event_counters' table from the 'tasks' and 'completed_tasks' rows, archived ones included.
+
+The storage write path keeps the counters up to date, so this is only needed
+after the counters are first created, after rows are changed outside the
+service, or if the counters are suspected to have drifted. The rebuild runs in
+one transaction; stop the storage consumer while it runs so no batch is
+counted twice. Run it from the storage directory:
+
+    python3 reconcile_counters.py
+"""
+
+from collections import Counter
+from sqlalchemy import create_engine, func, select
+from archive import archive_tables, date_bucket
+from counter import EventCounter, HOUR_FORMAT
+from migrate import DATABASE_URL
+from writer import EVENT_TABLES
+
+
+def count_rows(conn, engine, event_type, table):
+    """
+    Returns the counter rows of one event type, computed with GROUP BY queries.
+    """
+    total = conn.execute(select([func.count()]).select_from(table)).scalar()
+    counters = [(event_type, 'total', '', total)]
+
+    difficulty_query = (select([table.c.task_difficulty, func.count()])
+                        .where(table.c.task_difficulty.isnot(None))
+                        .group_by(table.c.task_difficulty))
+    counters += [(event_type, 'difficulty', str(difficulty), events)
+                 for difficulty, events in conn.execute(difficulty_query)]
+
+    hour = date_bucket(engine, table.c.date_created, HOUR_FORMAT)
+    hour_query = select([hour, func.count()]).where(table.c.date_created.isnot(None)).group_by(hour)
+    counters += [(event_type, 'hour', bucket, events) for bucket, events in conn.execute(hour_query)]
+    return counters
+
+
+def reconcile(engine):
+    """
+    Replaces every counter with one computed from the base tables and their archives.
+    """
+    counter_table = EventCounter.__table__
+    with engine.begin() as conn:
+        counts = Counter()
+        for event_type, table in EVENT_TABLES.items():
+            for source in [table] + archive_tables(conn, table):
+                for _, dimension, bucket, events in count_rows(conn, engine, event_type, source):
+                    counts[(event_type, dimension, bucket)] += events
+        rows = [
+            {'event_type': event_type, 'dimension': dimension, 'bucket': bucket, 'events': events}
+            for (event_type, dimension, bucket), events in counts.items()
+        ]
+        conn.execute(counter_table.delete())
+        if rows:
+            conn.execute(counter_table.insert(), rows)
+    return rows
+
+
+def main():
+    """
+    Rebuilds the counters and prints the totals.
+    """
+    engine = create_engine(DATABASE_URL)
+    rows = reconcile(engine)
+    for row in rows:
+        if row['dimension'] == 'total':
+            print(f"{row['event_type']}: {row['events']} events")
+    print(f"Rebuilt {len(rows)} counters.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+This module provides the ORM-free read path of the storage list endpoints.
+
+The endpoints select only the columns they return, as plain row tuples, turn
+each chunk of rows into records with one comprehension and encode them with
+orjson, which writes datetimes itself. The standard json module is used when
+orjson is not installed.
+"""
+
+import json
+from create import Create
+from complete import Complete
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Returned fields in select order; 'id' is selected last for the cursor only
+TASK_FIELDS = ('trace_id', 'task_name', 'due_date', 'task_description', 'task_difficulty', 'uuid',
+               'date_created')
+TASK_COLUMNS = [getattr(Create, field) for field in TASK_FIELDS] + [Create.id]
+
+COMPLETED_TASK_FIELDS = ('trace_id', 'task_name', 'task_difficulty', 'uuid', 'completed_by', 'date_created')
+COMPLETED_TASK_COLUMNS = [getattr(Complete, field) for field in COMPLETED_TASK_FIELDS] + [Complete.id]
+
+
+def dumps(obj):
+    """
+    Encodes an object as JSON bytes, writing datetimes in ISO 8601.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=lambda value: value.isoformat()).encode('utf-8')
+
+
+def task_records(rows):
+    """
+    Turns 'tasks' rows selected with TASK_COLUMNS into API records.
+    """
+    return [dict(zip(TASK_FIELDS, row)) for row in rows]
+
+
+def completed_task_records(rows):
+    """
+    Turns 'completed_tasks' rows selected with COMPLETED_TASK_COLUMNS into API
+    records, with date_created as 'YYYY-MM-DD HH:MM:SS'.
+    """
+    return [
+        {
+            'trace_id': row[0],
+            'task_name': row[1],
+            'task_difficulty': row[2],
+            'uuid': row[3],
+            'completed_by': row[4],
+            'date_created': row[5].isoformat(' ', 'seconds')
+        }
+        for row in rows
+    ]
@@ -0,0 +1,170 @@
+"""
+This module routes the storage read endpoints to read replicas that are close enough to the primary.
+
+The service writes the time into the single 'replication_heartbeat' row on
+the primary every few seconds. A replica's lag is how far its copy of that row
+is behind the primary's, which works the same for MySQL replication and for a
+SQLite file copied from the primary. Replicas are checked on a schedule rather
+than on the request path; a read goes to the next replica, round robin, whose
+last check found it reachable and within the lag tolerance, and to the primary
+when there is none.
+
+To try it locally, point the datastore and one replica at SQLite files:
+
+    datastore:
+      url: sqlite:///primary.db
+      replication:
+        replicas:
+          - url: sqlite:///replica.db
+
+create the primary's tables with 'python3 migrate.py upgrade', and copy
+primary.db over replica.db to "replicate"; the replica is used for as long as
+the copy is within max_lag_sec of the primary's heartbeat.
+"""
+
+import logging
+import threading
+from datetime import datetime
+from itertools import count
+from sqlalchemy import select
+from db import PoolStats, create_db_engine
+from heartbeat import ReplicationHeartbeat, HEARTBEAT_ID
+
+logger = logging.getLogger('basicLogger')
+
+
+class Replica:
+    """
+    A replica engine and the result of its last lag check.
+    """
+
+    def __init__(self, name, engine, stats):
+        """
+        Initializes a replica that is not used until a check passes.
+        """
+        self.name = name
+        self.engine = engine
+        self.stats = stats
+        self.healthy = False
+        self.lag_sec = None
+        self.checked_at = None
+        self.last_error = None
+        self.reads = 0
+
+
+class ReplicaRouter:
+    """
+    Picks the engine of each read and keeps the heartbeat and replica lag up to date.
+    """
+
+    def __init__(self, primary, db_config):
+        """
+        Creates the replica engines of the 'replication' subsection of the datastore section.
+        """
+        replication = db_config.get('replication', {})
+        self.primary = primary
+        self.max_lag_sec = replication.get('max_lag_sec', 5)
+        self.check_sec = replication.get('check_sec', 5)
+        self.heartbeat_sec = replication.get('heartbeat_sec', 1)
+        self.lock = threading.Lock()
+        self.turns = count()
+        self.primary_reads = 0
+        self.replicas = []
+        for index, replica_config in enumerate(replication.get('replicas') or []):
+            stats = PoolStats()
+            engine = create_db_engine({**db_config, **replica_config}, stats)
+            name = replica_config.get('hostname') or f"replica-{index}"
+            self.replicas.append(Replica(name, engine, stats))
+
+    @property
+    def staleness_sec(self):
+        """
+        Returns how far behind the primary a read from a healthy replica can be.
+
+        The lag is measured to within a heartbeat and can grow until the next check.
+        """
+        return self.max_lag_sec + self.heartbeat_sec + self.check_sec
+
+    def beat(self):
+        """
+        Writes the current time into the heartbeat row on the primary.
+        """
+        table = ReplicationHeartbeat.__table__
+        with self.primary.begin() as conn:
+            updated = conn.execute(table.update().where(table.c.id == HEARTBEAT_ID).values(beat_at=datetime.now()))
+            if not updated.rowcount:
+                conn.execute(table.insert().values(id=HEARTBEAT_ID, beat_at=datetime.now()))
+
+    def check(self):
+        """
+        Measures the lag of every replica against the primary's heartbeat.
+        """
+        try:
+            primary_beat = read_heartbeat(self.primary)
+        except Exception as e:
+            logger.error(f"Could not read the primary heartbeat: {str(e)}")
+            primary_beat = None
+
+        for replica in self.replicas:
+            try:
+                replica_beat = read_heartbeat(replica.engine)
+                if primary_beat is None or replica_beat is None:
+                    raise ValueError("no heartbeat to compare")
+                lag_sec = max(0.0, (primary_beat - replica_beat).total_seconds())
+                healthy, error = lag_sec <= self.max_lag_sec, None
+            except Exception as e:
+                lag_sec, healthy, error = None, False, str(e)
+
+            with self.lock:
+                if replica.healthy and not healthy:
+                    reason = error or f"lag {lag_sec:.1f} s"
+                    logger.warning(f"Replica {replica.name} taken out of reads: {reason}")
+                elif healthy and not replica.healthy:
+                    logger.info(f"Replica {replica.name} used for reads, lag {lag_sec:.1f} s")
+                replica.healthy = healthy
+                replica.lag_sec = lag_sec
+                replica.last_error = error
+                replica.checked_at = datetime.now()
+
+    def route(self, primary=False):
+        """
+        Returns the engine for a read and how stale its data can be, in seconds;
+        the primary's for a read that must see every committed write.
+        """
+        with self.lock:
+            healthy = [replica for replica in self.replicas if replica.healthy and not primary]
+            if not healthy:
+                self.primary_reads += 1
+                return self.primary, 0
+            replica = healthy[next(self.turns) % len(healthy)]
+            replica.reads += 1
+            return replica.engine, self.staleness_sec
+
+    def snapshot(self):
+        """
+        Returns the reads per engine and the state and pool figures of every replica.
+        """
+        with self.lock:
+            replicas = [
+                {
+                    "name": replica.name,
+                    "healthy": replica.healthy,
+                    "lag_sec": replica.lag_sec,
+                    "checked_at": replica.checked_at.isoformat(timespec='seconds') if replica.checked_at else None,
+                    "last_error": replica.last_error,
+                    "reads": replica.reads,
+                    "db_pool": replica.stats.snapshot(replica.engine.pool)
+                }
+                for replica in self.replicas
+            ]
+            primary_reads = self.primary_reads
+        return {"max_lag_sec": self.max_lag_sec, "primary_reads": primary_reads, "replicas": replicas}
+
+
+def read_heartbeat(engine):
+    """
+    Returns the heartbeat time stored in a database, or None if it has none.
+    """
+    table = ReplicationHeartbeat.__table__
+    with engine.connect() as conn:
+        return conn.execute(select([table.c.beat_at]).where(table.c.id == HEARTBEAT_ID)).scalar()
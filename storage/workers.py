@@ -0,0 +1,261 @@
+"""
+This module runs the storage consumer as one fetch thread feeding a pool of writer threads.
+
+Messages are sharded over the writers by a hash of their key, the task uuid,
+so the create and complete events of one task are written in order by the
+same writer while different tasks are written concurrently. Each writer
+drains whatever is queued for it, up to a batch, into one transaction.
+
+Offsets are committed per partition only up to the highest offset below
+which every fetched message has been written, so a restart never skips an
+event that was still queued or being written.
+
+A writer whose batch raises fails the whole pool: the fetch thread raises
+its error, so the consumer is restarted from the committed offsets and the
+batch is fetched again, instead of the shard's offsets staying in flight
+and its queue filling up for good.
+"""
+
+import logging
+import threading
+import zlib
+from queue import Queue, Empty, Full
+from time import monotonic
+import envelope
+from writer import BatchStats
+
+logger = logging.getLogger('basicLogger')
+
+# How often the fetch thread, waiting on a full queue, checks for a failed writer
+QUEUE_PUT_TIMEOUT_SEC = 1
+
+
+class OffsetTracker:
+    """
+    Tracks fetched and written offsets per partition to find the commit watermarks.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty tracker.
+        """
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_fetched = {}
+
+    def fetched(self, partition_id, offset):
+        """
+        Records an offset handed to a writer.
+        """
+        with self.lock:
+            self.pending.setdefault(partition_id, set()).add(offset)
+            # After a rebalance the partition restarts from its committed offset
+            self.last_fetched[partition_id] = offset
+
+    def written(self, partition_id, offset):
+        """
+        Records an offset whose message has been written.
+        """
+        with self.lock:
+            self.pending[partition_id].discard(offset)
+
+    def watermarks(self):
+        """
+        Returns, per partition, the highest offset with no unwritten message at or below it.
+        """
+        with self.lock:
+            return {
+                partition_id: min(self.pending[partition_id]) - 1 if self.pending[partition_id] else last
+                for partition_id, last in self.last_fetched.items()
+            }
+
+    def in_flight(self):
+        """
+        Returns the number of fetched messages not written yet.
+        """
+        with self.lock:
+            return sum(len(offsets) for offsets in self.pending.values())
+
+
+def owned_partitions(consumer):
+    """
+    Returns the consumer's owned partitions by partition id.
+
+    A balanced consumer holds them in its current simple consumer, which is
+    replaced on every rebalance.
+    """
+    inner = getattr(consumer, '_consumer', None) or consumer
+    return getattr(inner, '_partitions_by_id', None) or {}
+
+
+def commit_watermarks(consumer, watermarks):
+    """
+    Commits the given offsets instead of the consumed positions.
+
+    pykafka 2.4's commit_offsets() commits each owned partition's last consumed
+    offset, so that position is lowered to the watermark for the commit and put
+    back afterwards.
+    """
+    partitions = owned_partitions(consumer)
+    consumed = {}
+    for partition_id, offset in watermarks.items():
+        owned = partitions.get(partition_id)
+        if owned is not None and offset < owned.last_offset_consumed:
+            consumed[partition_id] = owned.last_offset_consumed
+            owned.last_offset_consumed = offset
+    try:
+        consumer.commit_offsets()
+    finally:
+        for partition_id, offset in consumed.items():
+            partitions[partition_id].last_offset_consumed = offset
+
+
+class WorkerPool:
+    """
+    Fetches messages on the calling thread and writes them on a pool of writer threads.
+    """
+
+    def __init__(self, store_messages, metrics, workers, queue_size, batch_size, commit_interval_ms):
+        """
+        Initializes the pool and starts the writer threads.
+        """
+        self.store_messages = store_messages
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval_ms / 1000
+        self.offsets = OffsetTracker()
+        self.queues = [Queue(maxsize=queue_size) for _ in range(workers)]
+        self.stats = [BatchStats() for _ in range(workers)]
+        self.committed = {}
+        self.failure = None
+        self.threads = []
+
+        for worker in range(workers):
+            thread = threading.Thread(target=self._write, args=(worker,), name=f"storage-writer-{worker}",
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def shard(self, msg):
+        """
+        Returns the writer for a message, keyed by its task uuid.
+        """
+        key = msg.partition_key
+        if not key:
+            # Events produced before they were keyed carry the uuid in the payload only
+            try:
+                key = envelope.decode(msg.value)['payload']['uuid'].encode('utf-8')
+            except Exception:
+                key = msg.value
+        return zlib.crc32(key) % len(self.queues)
+
+    def run(self, consumer):
+        """
+        Hands messages to the writers and commits the watermarks every commit
+        interval. Raises the error of a writer that failed.
+        """
+        next_commit = monotonic() + self.commit_interval
+        while True:
+            self.check()
+            # Returns None once the consumer timeout passes without a message
+            msg = consumer.consume(block=True)
+            if msg is not None:
+                self.offsets.fetched(msg.partition_id, msg.offset)
+                queue = self.queues[self.shard(msg)]
+                while True:
+                    try:
+                        queue.put(msg, timeout=QUEUE_PUT_TIMEOUT_SEC)
+                        break
+                    except Full:
+                        self.check()
+
+            if monotonic() >= next_commit:
+                self.commit(consumer)
+                next_commit = monotonic() + self.commit_interval
+
+    def check(self):
+        """
+        Raises the error of the first writer that failed, if any.
+        """
+        if self.failure is not None:
+            raise RuntimeError(f"Storage writer failed: {self.failure}") from self.failure
+
+    def commit(self, consumer):
+        """
+        Commits every partition up to its watermark, if it moved.
+        """
+        watermarks = self.offsets.watermarks()
+        if watermarks == self.committed:
+            return
+        commit_watermarks(consumer, watermarks)
+        self.metrics.record_commit(watermarks)
+        self.committed = watermarks
+
+    def _write(self, worker):
+        """
+        Writes the messages of one shard, draining up to a batch per transaction.
+        """
+        queue = self.queues[worker]
+        while True:
+            msg = queue.get()
+            if msg is None:
+                return
+            msgs = [msg]
+            while len(msgs) < self.batch_size:
+                try:
+                    msg = queue.get_nowait()
+                except Empty:
+                    break
+                if msg is None:
+                    # Write what was drained, then stop on the next get
+                    queue.put(None)
+                    break
+                msgs.append(msg)
+
+            started = monotonic()
+            try:
+                written = self.store_messages(msgs)
+            except Exception as e:
+                # Left in flight, so nothing from here on is committed until the pool restarts
+                logger.error(f"Storage writer {worker} failed on a batch of {len(msgs)} messages: {str(e)}")
+                self.failure = e
+                return
+            elapsed = monotonic() - started
+            self.stats[worker].record(written, elapsed)
+            self.metrics.record(msgs, elapsed)
+
+            for msg in msgs:
+                self.offsets.written(msg.partition_id, msg.offset)
+
+    def stop(self):
+        """
+        Stops the writer threads once they have written their current batch.
+
+        What is still queued is dropped: it was not committed, so the restarted
+        consumer fetches it again.
+        """
+        for queue in self.queues:
+            while True:
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    break
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def snapshot(self):
+        """
+        Returns per-writer throughput and queue depth, and the committed offsets.
+        """
+        writers = []
+        for worker, stats in enumerate(self.stats):
+            writer_stats = stats.snapshot()
+            writer_stats["worker"] = worker
+            writer_stats["queue_depth"] = self.queues[worker].qsize()
+            writers.append(writer_stats)
+        return {
+            "writers": writers,
+            "in_flight": self.offsets.in_flight(),
+            "committed_offsets": {str(partition_id): offset for partition_id, offset in self.committed.items()}
+        }
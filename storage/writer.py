@@ -0,0 +1,251 @@
+"""
+This module writes batches of Kafka events to the database with bulk inserts.
+"""
+
+import logging
+import threading
+from collections import Counter, deque
+from time import monotonic
+from sqlalchemy import select, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from create import Create
+from complete import Complete
+from counter import EventCounter, HOUR_FORMAT
+import query_cache
+
+logger = logging.getLogger('basicLogger')
+
+# Number of recent batches used for the throughput figures
+STATS_WINDOW = 100
+
+
+def create_row(payload, now):
+    """
+    Builds the 'tasks' row for a 'create' event payload.
+    """
+    return {
+        'trace_id': payload['trace_id'],
+        'task_name': payload['task_name'],
+        'due_date': payload['due_date'],
+        'task_description': payload['task_description'],
+        'task_difficulty': payload['task_difficulty'],
+        'uuid': payload['uuid'],
+        'date_created': now
+    }
+
+
+def complete_row(payload, now):
+    """
+    Builds the 'completed_tasks' row for a 'complete' event payload.
+    """
+    return {
+        'trace_id': payload['trace_id'],
+        'task_name': payload['task_name'],
+        'task_difficulty': payload.get('task_difficulty'),
+        'uuid': payload['uuid'],
+        'completed_by': payload.get('completed_by'),
+        'completed_at': now,
+        'completion_status': True,
+        'date_created': now,
+        'task_created_at': payload.get('task_created_at')
+    }
+
+
+# Target table and row builder for each event type
+ROW_BUILDERS = {
+    'create': (Create.__table__, create_row),
+    'complete': (Complete.__table__, complete_row)
+}
+EVENT_TABLES = {event_type: table for event_type, (table, _) in ROW_BUILDERS.items()}
+
+# Columns left as first written when an event is replayed
+KEEP_ON_DUPLICATE = ('id', 'uuid', 'trace_id', 'date_created', 'completed_at', 'task_created_at')
+
+
+def upsert_rows(session, table, rows):
+    """
+    Inserts rows keyed on the table's unique uuid, updating the row in place
+    when the uuid already exists, so replayed events neither fail nor duplicate.
+    """
+    columns = list(rows[0])
+    updates = [column for column in columns if column not in KEEP_ON_DUPLICATE]
+    dialect = session.bind.dialect.name
+
+    if dialect == 'mysql':
+        statement = mysql_insert(table)
+        statement = statement.on_duplicate_key_update(
+            {column: statement.inserted[column] for column in updates}
+        )
+    elif dialect == 'sqlite':
+        # SQLite (3.24+) spells the same upsert as ON CONFLICT ... DO UPDATE
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in updates)
+        statement = text(
+            f"INSERT INTO {table.name} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(':' + column for column in columns)}) "
+            f"ON CONFLICT (uuid) DO UPDATE SET {assignments}"
+        )
+    else:
+        statement = table.insert()
+    session.execute(statement, rows)
+
+
+def stored_dates(session, table, rows):
+    """
+    Returns the date_created of the stored rows sharing a uuid with the given rows, by uuid.
+    """
+    uuids = {row['uuid'] for row in rows}
+    query = select([table.c.uuid, table.c.date_created]).where(table.c.uuid.in_(uuids))
+    return dict(session.execute(query).fetchall())
+
+
+def fill_task_created_at(session, rows):
+    """
+    Sets the task_created_at of 'completed_tasks' rows that have none to the
+    date_created of the live task with the same uuid, when there is one.
+    """
+    uuids = {row['uuid'] for row in rows if row.get('task_created_at') is None}
+    if not uuids:
+        return
+    tasks = Create.__table__
+    created = dict(session.execute(
+        select([tasks.c.uuid, tasks.c.date_created]).where(tasks.c.uuid.in_(uuids))
+    ).fetchall())
+    for row in rows:
+        if row.get('task_created_at') is None:
+            row['task_created_at'] = created.get(row['uuid'])
+
+
+def new_rows(rows, stored):
+    """
+    Returns the rows whose uuid is not among the stored ones, counting a uuid
+    repeated within the rows once.
+    """
+    seen = set(stored)
+    fresh = []
+    for row in rows:
+        if row['uuid'] not in seen:
+            seen.add(row['uuid'])
+            fresh.append(row)
+    return fresh
+
+
+def counter_increments(event_type, rows, sign=1):
+    """
+    Returns the counter changes for adding (or, with sign=-1, removing) rows of an event type.
+    """
+    increments = Counter()
+    for row in rows:
+        increments[(event_type, 'total', '')] += sign
+        if row.get('task_difficulty') is not None:
+            increments[(event_type, 'difficulty', str(row['task_difficulty']))] += sign
+        increments[(event_type, 'hour', row['date_created'].strftime(HOUR_FORMAT))] += sign
+    return increments
+
+
+def increment_counters(session, increments):
+    """
+    Adds counter changes to the 'event_counters' table, creating missing buckets.
+    """
+    rows = [
+        {'event_type': event_type, 'dimension': dimension, 'bucket': bucket, 'events': events}
+        for (event_type, dimension, bucket), events in increments.items() if events
+    ]
+    if not rows:
+        return
+
+    table = EventCounter.__table__
+    if session.bind.dialect.name == 'sqlite':
+        statement = text(
+            "INSERT INTO event_counters (event_type, dimension, bucket, events) "
+            "VALUES (:event_type, :dimension, :bucket, :events) "
+            "ON CONFLICT (event_type, dimension, bucket) DO UPDATE SET events = events + excluded.events"
+        )
+    else:
+        statement = mysql_insert(table)
+        statement = statement.on_duplicate_key_update(events=table.c.events + statement.inserted.events)
+    session.execute(statement, rows)
+
+
+def store_rows(session, event_type, rows):
+    """
+    Upserts rows of one event type and counts the ones that were not stored
+    before, in the session's transaction.
+    """
+    table = EVENT_TABLES[event_type]
+    if event_type == 'complete':
+        fill_task_created_at(session, rows)
+    stored = stored_dates(session, table, rows)
+    fresh = new_rows(rows, stored)
+    upsert_rows(session, table, rows)
+    increment_counters(session, counter_increments(event_type, fresh))
+    # Replayed events update rows written earlier, which cached reads may hold
+    query_cache.touch(session, table.name, stored.values())
+
+
+def event_row(event, now):
+    """
+    Returns the event type and row of a decoded event. Raises ValueError for
+    an unknown event type and KeyError or TypeError for a malformed payload.
+    """
+    event_type = event.get('type') if isinstance(event, dict) else None
+    if event_type not in ROW_BUILDERS:
+        raise ValueError(f"Unknown event type {event_type!r}")
+    _, build_row = ROW_BUILDERS[event_type]
+    return event_type, build_row(event['payload'], now)
+
+
+def store_batch(session, groups):
+    """
+    Upserts rows grouped by event type with one bulk statement per table and
+    updates the event counters in the session's transaction. Returns the
+    number of rows written; the caller commits.
+    """
+    written = 0
+    # Creates first, so completions of tasks created in the same batch find them
+    for event_type in EVENT_TABLES:
+        rows = groups.get(event_type)
+        if rows:
+            store_rows(session, event_type, rows)
+            written += len(rows)
+    return written
+
+
+class BatchStats:
+    """
+    Tracks batch sizes, flush latency and rows/sec of the batching consumer.
+    """
+
+    def __init__(self):
+        """
+        Initializes empty statistics.
+        """
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=STATS_WINDOW)
+        self.batches = 0
+        self.rows = 0
+
+    def record(self, rows, flush_seconds):
+        """
+        Records one flushed batch.
+        """
+        with self.lock:
+            self.batches += 1
+            self.rows += rows
+            self.recent.append((monotonic(), rows, flush_seconds))
+
+    def snapshot(self):
+        """
+        Returns totals and figures over the recent batches.
+        """
+        with self.lock:
+            recent = list(self.recent)
+            stats = {"batches": self.batches, "rows": self.rows}
+
+        rows = sum(batch[1] for batch in recent)
+        flush_seconds = sum(batch[2] for batch in recent)
+        elapsed = monotonic() - recent[0][0] if len(recent) > 1 else 0
+        stats["avg_batch_size"] = rows / len(recent) if recent else 0
+        stats["avg_flush_ms"] = flush_seconds / len(recent) * 1000 if recent else 0
+        stats["rows_per_sec"] = rows / elapsed if elapsed else 0
+        stats["write_rows_per_sec"] = rows / flush_seconds if flush_seconds else 0
+        return stats